@@ -0,0 +1,207 @@
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+
+from ballsdex.packages.battle.xe_battle_lib import (
+    CRIT_CHANCE,
+    CRIT_MULTIPLIER,
+    DODGE_CHANCE,
+    BattleBall,
+    BattleInstance,
+    gen_events,
+    np,
+    simulate_many,
+)
+
+AUTODECK_TIME_BUDGET = 5.0  # seconds a search may take, the best deck so far is kept
+AUTODECK_POOL_SIZE = 48  # balls of the collection kept after pruning
+AUTODECK_SHORTLIST = 12  # decks simulated per search step, picked by surrogate score
+AUTODECK_BATTLES = 512  # simulated battles per deck and opponent deck
+
+Stats = Tuple[int, int]  # (health, attack)
+
+
+@dataclass
+class AutoDeck:
+    ids: List[int]
+    win_rate: float
+    decks_evaluated: int
+    seconds: float
+    complete: bool  # False if the time budget ran out before the search converged
+
+
+def hit_damage(attack: int) -> float:
+    """Average damage of an attack turn, crits and dodges included."""
+    return attack * 0.75 * (1 + CRIT_CHANCE * (CRIT_MULTIPLIER - 1)) * (1 - DODGE_CHANCE)
+
+
+def surrogate(deck: Sequence[Stats], opponents: Sequence[Sequence[Stats]]) -> float:
+    """
+    Cheap estimate of the win rate of a deck, from Lanchester's square law:
+    a deck is as strong as its total health times its total damage per round.
+    Only used to rank decks before simulating them.
+    """
+    strength = sum(health for health, _ in deck) * sum(hit_damage(attack) for _, attack in deck)
+    score = 0.0
+    for opponent in opponents:
+        enemy = sum(health for health, _ in opponent) * sum(
+            hit_damage(attack) for _, attack in opponent
+        )
+        score += strength / (strength + enemy) if strength + enemy else 0.5
+    return score / len(opponents)
+
+
+def prune(candidates: Sequence[Tuple[int, int, int]], deck_size: int) -> List[Tuple[int, Stats]]:
+    """
+    Reduces a collection to the balls worth searching: the best ones by health,
+    by attack and by both, without copies beyond `deck_size` of the same stats,
+    and without balls beaten on both stats by `deck_size` others of the pool.
+    """
+    per_key = AUTODECK_POOL_SIZE // 3
+    pool: Dict[int, Stats] = {}
+    copies: Dict[Stats, int] = {}
+    for key in (
+        lambda ball: ball[1],
+        lambda ball: ball[2],
+        lambda ball: ball[1] * ball[2],
+    ):
+        taken = 0
+        for instance_id, health, attack in sorted(candidates, key=key, reverse=True):
+            if taken >= per_key:
+                break
+            if instance_id in pool or copies.get((health, attack), 0) >= deck_size:
+                continue
+            copies[(health, attack)] = copies.get((health, attack), 0) + 1
+            pool[instance_id] = (health, attack)
+            taken += 1
+
+    return [
+        (instance_id, stats)
+        for instance_id, stats in pool.items()
+        if sum(
+            other[0] >= stats[0] and other[1] >= stats[1] and other != stats
+            for other in pool.values()
+        )
+        < deck_size
+    ]
+
+
+def _deck_key(pool, members) -> Tuple[Stats, ...]:
+    # balls with the same stats are interchangeable, decks are simulated in this order
+    return tuple(sorted((pool[index][1] for index in members), reverse=True))
+
+
+def _balls(deck):
+    return [BattleBall("", "", health, attack) for health, attack in deck]
+
+
+def _win_rates(decks, opponents, battles, seed) -> List[float]:
+    """Simulated win rate of every deck against the opponent decks, all in one batch."""
+    if np is not None:
+        pairs = [(_balls(deck), _balls(opponent)) for deck in decks for opponent in opponents]
+        results = simulate_many(pairs, battles, seed)
+        return [
+            sum(result.p1_win_rate for result in results[i : i + len(opponents)])
+            / len(opponents)
+            for i in range(0, len(results), len(opponents))
+        ]
+
+    # without numpy, fall back to a (much smaller) number of regular battles
+    battles = max(1, battles // 8)
+    rates = []
+    for deck in decks:
+        wins = 0
+        for opponent in opponents:
+            rng = random.Random(seed)
+            for _ in range(battles):
+                battle = BattleInstance(_balls(deck), _balls(opponent))
+                for _ in gen_events(battle, rng):
+                    pass
+                wins += all(ball.dead for ball in battle.p2_balls)
+        rates.append(wins / (battles * len(opponents)))
+    return rates
+
+
+def optimize_deck(
+    candidates: Sequence[Tuple[int, int, int]],
+    opponents: Sequence[Sequence[Stats]],
+    deck_size: int,
+    time_budget: float = AUTODECK_TIME_BUDGET,
+    battles: int = AUTODECK_BATTLES,
+    seed: int = 0,
+) -> AutoDeck:
+    """
+    Searches the strongest `deck_size` balls of a collection against the
+    opponent decks. `candidates` are (instance ID, health, attack) tuples.
+
+    The collection is pruned, a first deck is built greedily by surrogate score
+    and then improved by swapping one ball at a time: every swap is ranked by
+    surrogate score and the best ones are simulated together, the search moves
+    to the best simulated deck until no swap beats it or the time budget is spent.
+    Simulated decks are cached, and every simulation uses the same seed.
+    Meant to be run in a worker process.
+    """
+    started = time.monotonic()
+    deadline = started + time_budget
+    opponents = [list(opponent) for opponent in opponents if opponent]
+    pool = prune(candidates, deck_size)
+    if not pool or not opponents:
+        return AutoDeck([instance_id for instance_id, _ in pool[:deck_size]], 0.0, 0, 0.0, True)
+    deck_size = min(deck_size, len(pool))
+
+    def score(members):
+        return surrogate(_deck_key(pool, members), opponents)
+
+    members: List[int] = []
+    while len(members) < deck_size:
+        members.append(
+            max(
+                (index for index in range(len(pool)) if index not in members),
+                key=lambda index: score(members + [index]),
+            )
+        )
+
+    evaluated: Dict[Tuple[Stats, ...], float] = {}
+
+    def evaluate(decks):
+        keys = list({_deck_key(pool, deck) for deck in decks} - evaluated.keys())
+        if keys:
+            evaluated.update(zip(keys, _win_rates(keys, opponents, battles, seed)))
+
+    evaluate([members])
+    best = evaluated[_deck_key(pool, members)]
+    complete = False
+
+    while time.monotonic() < deadline:
+        swaps = [
+            members[:i] + members[i + 1 :] + [index]
+            for i in range(len(members))
+            for index in range(len(pool))
+            if index not in members
+        ]
+        swaps = [swap for swap in swaps if _deck_key(pool, swap) not in evaluated]
+        if not swaps:
+            complete = True
+            break
+        swaps.sort(key=score, reverse=True)
+        shortlist = swaps[:AUTODECK_SHORTLIST]
+        evaluate(shortlist)
+
+        challenger = max(shortlist, key=lambda swap: evaluated[_deck_key(pool, swap)])
+        rate = evaluated[_deck_key(pool, challenger)]
+        if rate > best:
+            members, best = challenger, rate
+        elif len(swaps) <= AUTODECK_SHORTLIST:
+            complete = True
+            break
+
+    # return the IDs in the order the deck was simulated in
+    members.sort(key=lambda index: pool[index][1], reverse=True)
+    return AutoDeck(
+        [pool[index][0] for index in members],
+        best,
+        len(evaluated),
+        time.monotonic() - started,
+        complete,
+    )
@@ -0,0 +1,49 @@
+from typing import TYPE_CHECKING, Dict, Iterable, NamedTuple, Optional
+
+import discord
+
+if TYPE_CHECKING:
+    from ballsdex.core.bot import BallsDexBot
+    from ballsdex.core.models import Ball
+
+
+class BallMetadata(NamedTuple):
+    ball: Optional["Ball"]
+    country: str
+    emoji: Optional[discord.Emoji]
+
+
+class BallMetadataCache:
+    """
+    Name and emoji of every countryball, keyed by ball ID, so that building
+    and rendering decks never goes through the ORM or the emoji lookup.
+
+    BallsDex replaces its Ball objects when its cache is reloaded after an
+    edit, so an entry is refreshed as soon as the Ball it was built from is
+    no longer the one in `ballsdex.core.models.balls`.
+    """
+
+    def __init__(self, bot: "BallsDexBot", balls: Dict[int, "Ball"]):
+        self.bot = bot
+        self.balls = balls
+        self.entries: Dict[int, BallMetadata] = {}
+
+    def warm(self, balls: Optional[Iterable["Ball"]] = None):
+        for ball in balls if balls is not None else list(self.balls.values()):
+            self.entries[ball.pk] = self._build(ball)
+
+    def get(self, ball_id: int) -> BallMetadata:
+        entry = self.entries.get(ball_id)
+        ball = self.balls.get(ball_id)
+        if ball is None:
+            # removed from BallsDex since, keep what was known about it
+            if entry is None:
+                entry = self.entries[ball_id] = BallMetadata(None, f"Ball #{ball_id}", None)
+            return entry
+        if entry is None or entry.ball is not ball or entry.emoji is None:
+            # emojis can't be resolved before the bot is connected, retry until they are
+            entry = self.entries[ball_id] = self._build(ball)
+        return entry
+
+    def _build(self, ball: "Ball") -> BallMetadata:
+        return BallMetadata(ball, ball.country, self.bot.get_emoji(ball.emoji_id))
@@ -1,83 +1,168 @@
 import logging
 import random
 import sys
-from typing import TYPE_CHECKING, Dict
+from functools import partial
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Literal, Optional, Tuple
 from dataclasses import dataclass, field
+from datetime import datetime, timezone
 
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 import asyncio
 import io
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-from ballsdex.core.models import Ball, Player
+from ballsdex.core.models import Ball, BallInstance, Player
 from ballsdex.core.models import balls as countryballs
 from ballsdex.settings import settings
 
-from ballsdex.core.utils.transformers import BallInstanceTransform
+from ballsdex.core.utils.transformers import BallInstanceTransform, BallTransform
+from ballsdex.packages.battle.autodeck import optimize_deck
+from ballsdex.packages.battle.cache import BallMetadataCache
+from ballsdex.packages.battle.matchmaking import Matchmaker, QueueEntry
+from ballsdex.packages.battle.messages import MessagePacks
+from ballsdex.packages.battle.persistence import BattleRecord, ResultWriter
+from ballsdex.packages.battle.pipeline import BattleSummary, run_pipeline, turn_events
+from ballsdex.packages.battle.render import (
+    DeckRenderer,
+    RenderBroadcast,
+    RenderScheduler,
+    gen_deck,
+    tournament_embed,
+    update_embed,
+)
+from ballsdex.packages.battle.stats import BattleStats, deep_sizeof
+from ballsdex.packages.battle.tournament import Match, Tournament
 from ballsdex.packages.battle.xe_battle_lib import (
+    EVENT_FORMAT,
+    ODDS_BATTLES,
     BattleBall,
     BattleInstance,
-    gen_battle,
+    BattleText,
+    MessagePack,
+    deck_stats,
+    estimate_odds,
+    pick_seed,
+    play_log,
+    simulate_log,
 )
 
 if TYPE_CHECKING:
     from ballsdex.core.bot import BallsDexBot
 log = logging.getLogger("ballsdex.packages.battle")
 
+TURN_INTERVAL = 3.5  # change the turn shift here if you want i mean idk
+SIMULATION_WORKERS = 2  # processes simulating big battles, 0 to keep everything in the bot
+OFFLOAD_MIN_BALLS = 32  # smaller battles are simulated in the bot, pickling would cost more
+SETUP_TTL = 10 * 60  # idle battle plans are cancelled after this many seconds
+# battle plans are cancelled at this age, counted from the interaction hosting them,
+# whose token expires after 15 minutes (a queue message may host a plan 4 minutes late)
+SETUP_MAX_AGE = 13 * 60
+BATTLE_TTL = 2 * 60 * 60  # running battles are forgotten after this many seconds
+REAPER_INTERVAL = 60
+SETUP_EDIT_DELAY = 1.0  # deck changes made within this many seconds share one edit
+MATCHMAKING_INTERVAL = 5  # seconds between two passes over the matchmaking queue
+ODDS_CACHE_SIZE = 512  # deck matchups whose odds are kept for /battle odds
+META_DECKS = 4  # decks of the reference meta /battle autodeck plays against without an opponent
+MAX_SPECTATORS = 10  # channels a live battle can be mirrored to with /battle spectate
+
 @dataclass
 class GuildBattle:
+    id: int
+    channel_id: int
     author: discord.Member
     opponent: discord.Member
     author_ready: bool = False
     opponent_ready: bool = False
     battle: BattleInstance = field(default_factory=BattleInstance)
     deck_size: int = 4
+    instant: bool = False
+    running: bool = False
+    created_at: float = field(default_factory=time.monotonic)  # of the hosting interaction
+    last_activity: float = field(default_factory=time.monotonic)
+    setup_update: Optional[asyncio.Task] = None
+    broadcast: Optional[RenderBroadcast] = None  # set while the battle is played live
+
+
+def gen_result(guild_battle: GuildBattle) -> str:
+    """Generates the description of a finished battle."""
+    return (
+        f"{guild_battle.author.mention} VS {guild_battle.opponent.mention}\n\n"
+        f"**Winner**: {guild_battle.battle.winner or 'Nobody, the turn limit was reached'}\n"
+        f"Total Turns: {guild_battle.battle.turns}"
+    )
 
 
-def gen_deck(balls) -> str:
-    """Generates a text representation of the player's deck with live status."""
-    if not balls:
-        return "Empty"
+def gen_summary(guild_battle: GuildBattle, summary: BattleSummary) -> str:
+    """Generates the per player totals of a finished battle."""
+    return "\n".join(
+        f"**{player.display_name}**: {summary.damage[side]} DMG, {summary.crits[side]} crits, "
+        f"{summary.dodges[side]} dodges, {summary.defeats[side]} defeated"
+        for side, player in enumerate((guild_battle.author, guild_battle.opponent))
+    )
 
-    lines = []
-    for ball in balls:
-        if ball.dead:
-            status = "💀"
-        else:
-            status = f"❤️ {ball.health} | ⚔️ {ball.attack}"
-        lines.append(f"- {ball.emoji} {ball.name} ({status})")
-    
-    return "\n".join(lines)
+
+def gen_transcript(
+    battle: BattleInstance, log: bytes, pack: Optional[MessagePack] = None
+) -> io.BytesIO:
+    """Plays the whole battle log, writing every turn straight into a text file buffer."""
+    buffer = io.BytesIO()
+    text = BattleText(battle, pack)
+    for event in play_log(battle, log):
+        buffer.write(text.format(event).encode())
+        buffer.write(b"\n")
+    buffer.seek(0)
+    return buffer
+
+
+def gen_instance_text(countryball: BallInstance, country: str) -> str:
+    """Generates the short description of a ball instance used in replies."""
+    attack_sign = "+" if countryball.attack_bonus >= 0 else ""
+    health_sign = "+" if countryball.health_bonus >= 0 else ""
+    return (
+        f"#{countryball.id} {country} "
+        f"({attack_sign}{countryball.attack_bonus}%/{health_sign}{countryball.health_bonus}%)"
+    )
 
 
-def update_embed(
-    author_balls, opponent_balls, author, opponent, author_ready, opponent_ready, max_size: int
-) -> discord.Embed:
-    """Creates an embed for the battle setup phase."""
+def gen_cancel_embed(guild_battle: GuildBattle, reason: str) -> discord.Embed:
+    """Creates the embed of a cancelled battle plan."""
     embed = discord.Embed(
         title="Battle Plan",
-        description=f"Add or remove balls you want to propose to the other player using the '/battle add' and '/battle remove' commands. Remember, you may add up to **{max_size}** balls in a deck for this battle. Once you've finished, click the tick button to start the battle.",
-        color=discord.Colour.blurple(),
+        description=reason,
+        color=discord.Color.red(),
     )
-
-    author_emoji = ":white_check_mark:" if author_ready else ""
-    opponent_emoji = ":white_check_mark:" if opponent_ready else ""
-
     embed.add_field(
-        name=f"{author_emoji} {author}'s deck:",
-        value=gen_deck(author_balls),
+        name=f"{guild_battle.author}'s deck:",
+        value=gen_deck(guild_battle.battle.p1_deck.values()),
         inline=True,
     )
     embed.add_field(
-        name=f"{opponent_emoji} {opponent}'s deck:",
-        value=gen_deck(opponent_balls),
+        name=f"{guild_battle.opponent}'s deck:",
+        value=gen_deck(guild_battle.battle.p2_deck.values()),
         inline=True,
     )
     return embed
 
 
+def reference_meta(deck_size: int) -> List[List[Tuple[int, int]]]:
+    """
+    Decks to optimize against when there is no opponent deck: the strongest
+    countryballs, and random picks of the enabled ones.
+    """
+    enabled = [ball for ball in countryballs.values() if ball.enabled]
+    enabled.sort(key=lambda ball: ball.health + ball.attack, reverse=True)
+    decks = [enabled[:deck_size]]
+    rng = random.Random(0)
+    for _ in range(META_DECKS - 1):
+        decks.append(rng.sample(enabled, min(deck_size, len(enabled))))
+    return [[(ball.health, ball.attack) for ball in deck] for deck in decks if deck]
+
+
 def create_disabled_buttons() -> discord.ui.View:
     """Creates a view with disabled start and cancel buttons."""
     view = discord.ui.View()
@@ -91,6 +176,7 @@ def create_disabled_buttons() -> discord.ui.View:
             style=discord.ButtonStyle.danger, emoji="✖", label="Cancel", disabled=True
         )
     )
+    return view
 
 
 class Battle(commands.GroupCog):
@@ -100,11 +186,188 @@ class Battle(commands.GroupCog):
 
     def __init__(self, bot: "BallsDexBot"):
         self.bot = bot
+        # battles and their setup interactions are keyed by battle ID, the ID of
+        # the /battle start interaction, with an index by user
         self.battles: Dict[int, GuildBattle] = {}
         self.interactions: Dict[int, discord.Interaction] = {}
+        self.user_battles: Dict[int, int] = {}
+        self.metrics = BattleStats()
+        self.render_scheduler = RenderScheduler(stats=self.metrics)
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.ball_cache = BallMetadataCache(bot, countryballs)
+        self.odds_cache: OrderedDict = OrderedDict()
+        self.tournaments: Dict[int, Tournament] = {}  # keyed by channel ID
+        self.results = ResultWriter()
+        self.matchmaker = Matchmaker()
+        self.message_packs = MessagePacks()
+
+    async def cog_load(self):
+        self.ball_cache.warm()
+        self.message_packs.load()
+        self.render_scheduler.start()
+        await self.results.start()
+        if SIMULATION_WORKERS:
+            self.executor = ProcessPoolExecutor(SIMULATION_WORKERS)
+        self.reaper.start()
+        self.matchmaking.start()
+
+    async def cog_unload(self):
+        self.reaper.cancel()
+        self.matchmaking.cancel()
+        await self.render_scheduler.stop()
+        await self.results.stop()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def simulate(self, battle: BattleInstance) -> bytes:
+        """
+        Simulates the battle and returns its binary log, without touching its balls.
+        Big battles are run in the process pool to keep the event loop free.
+        """
+        seed = pick_seed(battle)
+        p1_stats, p2_stats = deck_stats(battle.p1_balls), deck_stats(battle.p2_balls)
+        started = time.perf_counter()
+        if self.executor is None or len(p1_stats) + len(p2_stats) < OFFLOAD_MIN_BALLS:
+            battle_log = simulate_log(p1_stats, p2_stats, seed)
+        else:
+            loop = asyncio.get_running_loop()
+            battle_log = await loop.run_in_executor(
+                self.executor, simulate_log, p1_stats, p2_stats, seed
+            )
 
-    async def start_battle(self, interaction: discord.Interaction):
-        guild_battle = self.battles.get(interaction.guild_id)
+        turns = len(battle_log) // EVENT_FORMAT.size
+        if turns:
+            self.metrics.incr("turns_simulated", turns)
+            self.metrics.observe(
+                "simulation_seconds_per_turn", (time.perf_counter() - started) / turns
+            )
+        return battle_log
+
+    def gauges(self) -> Dict[str, float]:
+        return {
+            "active_battles": len(self.battles),
+            "render_backlog_turns": self.render_scheduler.backlog,
+            "results_backlog": self.results.backlog,
+            "matchmaking_queue": len(self.matchmaker),
+            "battles_memory_bytes": deep_sizeof(self.battles),
+            "interactions_memory_bytes": deep_sizeof(self.interactions),
+        }
+
+    def get_battle(self, user: discord.abc.User) -> Optional[GuildBattle]:
+        """Returns the battle this user takes part in, if any."""
+        return self.battles.get(self.user_battles.get(user.id))
+
+    def open_battle(self, guild_battle: GuildBattle, interaction: discord.Interaction):
+        self.matchmaker.leave(guild_battle.author.id)
+        self.matchmaker.leave(guild_battle.opponent.id)
+        self.battles[guild_battle.id] = guild_battle
+        self.interactions[guild_battle.id] = interaction
+        self.user_battles[guild_battle.author.id] = guild_battle.id
+        self.user_battles[guild_battle.opponent.id] = guild_battle.id
+
+    def close_battle(self, battle_id: int):
+        guild_battle = self.battles.pop(battle_id, None)
+        self.interactions.pop(battle_id, None)
+        if not guild_battle:
+            return
+        for user in (guild_battle.author, guild_battle.opponent):
+            if self.user_battles.get(user.id) == battle_id:
+                del self.user_battles[user.id]
+
+    @tasks.loop(seconds=REAPER_INTERVAL)
+    async def reaper(self):
+        """Evicts idle battle plans and battles that never finished."""
+        now = time.monotonic()
+        for battle_id, guild_battle in list(self.battles.items()):
+            if guild_battle.running:
+                if now - guild_battle.created_at < BATTLE_TTL:
+                    continue
+                reason = None
+            elif now - guild_battle.created_at >= SETUP_MAX_AGE:
+                # still editable now, but not for long
+                reason = "The battle has been cancelled as the plan took too long."
+            elif now - guild_battle.last_activity >= SETUP_TTL:
+                reason = "The battle has been cancelled due to inactivity."
+            else:
+                continue
+
+            interaction = self.interactions.get(battle_id)
+            self.close_battle(battle_id)
+            self.metrics.incr("battles_expired")
+            if interaction is None or reason is None:
+                continue
+            try:
+                await interaction.edit_original_response(
+                    embed=gen_cancel_embed(guild_battle, reason),
+                    view=create_disabled_buttons(),
+                )
+            except discord.HTTPException:
+                pass
+
+    @reaper.error
+    async def reaper_error(self, error: BaseException):
+        log.error("Battle reaper failed", exc_info=error)
+
+    @tasks.loop(seconds=MATCHMAKING_INTERVAL)
+    async def matchmaking(self):
+        """Matches the queued players whose search window widened enough, and times out others."""
+        matches, expired = self.matchmaker.sweep()
+        for entry, opponent in matches:
+            # the newest queue message hosts the plan, its interaction has the most time left
+            waiting, host = sorted((entry, opponent), key=lambda entry: entry.joined_at)
+            try:
+                await self.host_match(host.data, waiting.data, host.pool[1], respond=False)
+            except discord.HTTPException:
+                log.warning("Failed to host a matchmaking battle", exc_info=True)
+        for entry in expired:
+            try:
+                await entry.data.edit_original_response(
+                    content=f"No opponent was found for {entry.data.user.mention}, "
+                    "try again later with `/battle queue`."
+                )
+            except discord.HTTPException:
+                pass
+
+    @matchmaking.error
+    async def matchmaking_error(self, error: BaseException):
+        log.error("Battle matchmaking failed", exc_info=error)
+
+    async def host_match(
+        self,
+        host: discord.Interaction,
+        waiting: discord.Interaction,
+        deck_size: int,
+        respond: bool,
+    ):
+        """
+        Opens the battle plan of two matched players on the message of `host`,
+        a new response if `respond` or its queue message otherwise.
+        The player who waited longer leads and their queue message links to the plan.
+        """
+        author, opponent = waiting.user, host.user
+        guild_battle, embed, view = self.new_battle(host, author, opponent, deck_size, False)
+        content = f"{author.mention} and {opponent.mention}, you have been matched!"
+        try:
+            if respond:
+                await host.response.send_message(content, embed=embed, view=view)
+            else:
+                await host.edit_original_response(content=content, embed=embed, view=view)
+        except discord.HTTPException:
+            self.close_battle(guild_battle.id)
+            raise
+
+        try:
+            message = await host.original_response()
+            await waiting.edit_original_response(
+                content=f"{author.mention}, you have been matched with {opponent.mention}! "
+                f"Build your deck here: {message.jump_url}"
+            )
+        except discord.HTTPException:
+            pass
+
+    async def start_battle(self, battle_id: int, interaction: discord.Interaction):
+        guild_battle = self.battles.get(battle_id)
         if not guild_battle or interaction.user not in (
             guild_battle.author,
             guild_battle.opponent,
@@ -114,120 +377,219 @@ class Battle(commands.GroupCog):
             )
             return
 
+        if guild_battle.running:
+            await interaction.response.send_message(
+                "This battle has already started!", ephemeral=True
+            )
+            return
+
+        guild_battle.last_activity = time.monotonic()
         if interaction.user == guild_battle.author:
             guild_battle.author_ready = True
         elif interaction.user == guild_battle.opponent:
             guild_battle.opponent_ready = True
 
         if guild_battle.author_ready and guild_battle.opponent_ready:
-            if not (guild_battle.battle.p1_balls and guild_battle.battle.p2_balls):
+            if not (guild_battle.battle.p1_deck and guild_battle.battle.p2_deck):
                 await interaction.response.send_message(
                     "Both players must add balls!"
                 )
                 return
-            new_view = create_disabled_buttons()
+            guild_battle.battle.lock_decks()
+            guild_battle.running = True
             try:
-                setup_interaction = self.interactions[interaction.guild_id]
+                setup_interaction = self.interactions.pop(battle_id)
                 await setup_interaction.delete_original_response()
             except Exception:
                 pass
             await interaction.response.defer()
 
-            battle = guild_battle.battle
-
-            embed = discord.Embed(
-                title="Battle in progress",
-                color=discord.Color.orange(),
-                description="Preparing turns...",
-            )
-            embed.add_field(
-                name=f"{guild_battle.author.display_name}'s Battle Deck",
-                value=gen_deck(battle.p1_balls),
-                inline=True,
-            )            
-            embed.add_field(
-                name=f"{guild_battle.opponent.display_name}'s Battle Deck",
-                value=gen_deck(battle.p2_balls),
-                inline=True,
-            )
-            embed.set_footer(text="Turn 0")
-
-            message = await interaction.followup.send(embed=embed, wait=True)
-
-            for turn_text in gen_battle(battle):
-                max_size = guild_battle.deck_size
-                embed.description = turn_text
-                embed.set_footer(text=f"Max Deck Size: {max_size}")
-
-                updated_p1 = gen_deck(battle.p1_balls)
-                updated_p2 = gen_deck(battle.p2_balls)
-    
-                embed.set_field_at(
-                    0,
-                    name=f"{guild_battle.author.display_name}'s Battle Deck",
-                    value=updated_p1,
-                    inline=True,
-                )
-                embed.set_field_at(
-                    1,
-                    name=f"{guild_battle.opponent.display_name}'s Battle Deck",
-                    value=updated_p2,
-                    inline=True,
-                )
-
-                await message.edit(embed=embed)
-                await asyncio.sleep(3.5) # change the turn shift here if you want i mean idk
-
-            embed.title = "Battle: Complete!"
-            embed.color = discord.Color.green()
-            embed.description = (
-                f"{guild_battle.author.mention} VS {guild_battle.opponent.mention}\n\n"
-                f"**Winner**: {battle.winner}\n"
-                f"Total Turns: {battle.turns}"
-            )
-            embed.set_footer(text="Battle concluded.")
-            await message.edit(embed=embed, view=new_view)
-            
-            self.battles[interaction.guild_id] = None
+            try:
+                if guild_battle.instant:
+                    await self.play_instant(interaction, guild_battle)
+                else:
+                    await self.play_live(interaction, guild_battle)
+                self.metrics.incr("battles_finished")
+                self.record_result(guild_battle, interaction.guild_id)
+            finally:
+                self.close_battle(battle_id)
 
         else:
 
             await interaction.response.send_message(
                 f"Done! Waiting for the other player to press 'Ready'.", ephemeral=True
             )
-
-            author_emoji = (
-                ":white_check_mark:" if interaction.user == guild_battle.author else ""
-            )
-            opponent_emoji = (
-                ":white_check_mark:"
-                if interaction.user == guild_battle.opponent
-                else ""
+            self.schedule_setup_update(guild_battle)
+
+    def record_result(self, guild_battle: GuildBattle, guild_id: Optional[int]):
+        """Queues the result of a finished battle to be saved, without waiting for it."""
+        battle = guild_battle.battle
+        if all(ball.dead for ball in battle.p2_balls):
+            winner_id = guild_battle.author.id
+        elif all(ball.dead for ball in battle.p1_balls):
+            winner_id = guild_battle.opponent.id
+        else:
+            winner_id = None
+        self.results.record(
+            BattleRecord(
+                guild_id=guild_id,
+                channel_id=guild_battle.channel_id,
+                player1_id=guild_battle.author.id,
+                player2_id=guild_battle.opponent.id,
+                player1_deck=list(battle.p1_deck),
+                player2_deck=list(battle.p2_deck),
+                winner_id=winner_id,
+                turns=battle.turns,
+                seed=battle.seed,
+                finished_at=datetime.now(timezone.utc),
             )
+        )
 
-            embed = discord.Embed(
-                title="Battle Plan",
-                description="Add or remove balls you want to propose to the other player using the '/battle add' and '/battle remove' commands. Remember, you may add up to **{max_size}** balls in a deck for this battle. Once you've finished, click the tick button to start the battle.",
-                color=discord.Colour.blurple(),
-            )
+    async def play_live(self, interaction: discord.Interaction, guild_battle: GuildBattle):
+        """Plays the battle turn by turn in a live embed."""
+        battle = guild_battle.battle
+        p1_deck = DeckRenderer(battle.p1_balls)
+        p2_deck = DeckRenderer(battle.p2_balls)
 
-            embed.add_field(
-                name=f"{author_emoji} {guild_battle.author.name}'s deck:",
-                value=gen_deck(guild_battle.battle.p1_balls),
+        embed = discord.Embed(
+            title="Battle in progress",
+            color=discord.Color.orange(),
+            description="Preparing turns...",
+        )
+        embed.add_field(
+            name=f"{guild_battle.author.display_name}'s Battle Deck",
+            value=p1_deck.render(),
+            inline=True,
+        )
+        embed.add_field(
+            name=f"{guild_battle.opponent.display_name}'s Battle Deck",
+            value=p2_deck.render(),
+            inline=True,
+        )
+        embed.set_footer(text="Turn 0")
+
+        message = await interaction.followup.send(embed=embed, wait=True)
+
+        def render(turns):
+            embed.description = "\n".join(turns) or "Preparing turns..."
+            embed.set_footer(text=f"Max Deck Size: {guild_battle.deck_size}")
+            embed.set_field_at(
+                0,
+                name=f"{guild_battle.author.display_name}'s Battle Deck",
+                value=p1_deck.render(),
                 inline=True,
             )
-            embed.add_field(
-                name=f"{opponent_emoji} {guild_battle.opponent.name}'s deck:",
-                value=gen_deck(guild_battle.battle.p2_balls),
+            embed.set_field_at(
+                1,
+                name=f"{guild_battle.opponent.display_name}'s Battle Deck",
+                value=p2_deck.render(),
                 inline=True,
             )
+            return embed
+
+        battle_log = await self.simulate(battle)
+        broadcast = guild_battle.broadcast = RenderBroadcast(self.render_scheduler, render)
+        broadcast.add(message)
+        summary = BattleSummary()
+        transcript = io.BytesIO()
+
+        # the decks are only rendered from the health snapshots of the turns,
+        # the balls themselves are ahead by up to a queue of turns
+        async def show(turns):
+            async for turn in turns:
+                event = turn.event
+                if event.dodge:
+                    pass
+                elif event.side == 1:
+                    p2_deck.mark(event.target, turn.p2_health[event.target])
+                else:
+                    p1_deck.mark(event.target, turn.p1_health[event.target])
+                broadcast.push(turn.text)
+                slept_at = time.monotonic()
+                await asyncio.sleep(TURN_INTERVAL)
+                self.metrics.observe(
+                    "turn_sleep_drift_seconds", time.monotonic() - slept_at - TURN_INTERVAL
+                )
+            await broadcast.flush()
+
+        async def write(turns):
+            async for turn in turns:
+                transcript.write(turn.text.encode())
+                transcript.write(b"\n")
 
-            await self.interactions[interaction.guild_id].edit_original_response(
-                embed=embed
+        try:
+            await run_pipeline(
+                turn_events(battle, battle_log, self.message_packs.get(interaction.guild_id)),
+                show,
+                write,
+                summary.consume,
             )
+        finally:
+            broadcast.close()
+            guild_battle.broadcast = None
+
+        embed.title = "Battle: Complete!"
+        embed.color = discord.Color.green()
+        embed.description = gen_result(guild_battle)
+        embed.add_field(
+            name="Battle stats", value=gen_summary(guild_battle, summary), inline=False
+        )
+        embed.set_footer(text=f"Battle concluded. Seed: {battle.seed}")
+        transcript.seek(0)
+        results = await asyncio.gather(
+            message.edit(
+                embed=embed,
+                view=create_disabled_buttons(),
+                attachments=[
+                    discord.File(transcript, filename=f"battle-{guild_battle.id}.txt")
+                ],
+            ),
+            *(
+                stream.message.edit(embed=embed)
+                for stream in broadcast.streams[1:]
+                if not stream.closed
+            ),
+            return_exceptions=True,
+        )
+        if isinstance(results[0], BaseException):
+            raise results[0]
+        for result in results[1:]:
+            if isinstance(result, discord.HTTPException):
+                log.warning(f"Failed to show the result of battle {guild_battle.id}: {result}")
+            elif isinstance(result, BaseException):
+                raise result
+
+    async def play_instant(self, interaction: discord.Interaction, guild_battle: GuildBattle):
+        """Resolves the whole battle at once and posts the result with the full turn log."""
+        battle = guild_battle.battle
+        transcript = gen_transcript(
+            battle, await self.simulate(battle), self.message_packs.get(interaction.guild_id)
+        )
+
+        embed = discord.Embed(
+            title="Battle: Complete!",
+            color=discord.Color.green(),
+            description=gen_result(guild_battle),
+        )
+        embed.add_field(
+            name=f"{guild_battle.author.display_name}'s Battle Deck",
+            value=gen_deck(battle.p1_balls),
+            inline=True,
+        )
+        embed.add_field(
+            name=f"{guild_battle.opponent.display_name}'s Battle Deck",
+            value=gen_deck(battle.p2_balls),
+            inline=True,
+        )
+        embed.set_footer(text=f"Battle concluded. Seed: {battle.seed}")
+
+        await interaction.followup.send(
+            embed=embed,
+            file=discord.File(transcript, filename=f"battle-{guild_battle.id}.txt"),
+        )
 
-    async def cancel_battle(self, interaction: discord.Interaction):
-        guild_battle = self.battles.get(interaction.guild_id)
+    async def cancel_battle(self, battle_id: int, interaction: discord.Interaction):
+        guild_battle = self.battles.get(battle_id)
 
         if not guild_battle:
             return
@@ -238,44 +600,86 @@ class Battle(commands.GroupCog):
             )
             return
 
-        embed = discord.Embed(
-            title="Battle Plan",
-            description="The battle has been cancelled.",
-            color=discord.Color.red(),
-        )
-        embed.add_field(
-            name=f"{guild_battle.author}'s deck:",
-            value=gen_deck(guild_battle.battle.p1_balls),
-            inline=True,
-        )
-        embed.add_field(
-            name=f"{guild_battle.opponent}'s deck:",
-            value=gen_deck(guild_battle.battle.p2_balls),
-            inline=True,
-        )
+        if guild_battle.running:
+            await interaction.response.send_message(
+                "This battle has already started!", ephemeral=True
+            )
+            return
+
+        embed = gen_cancel_embed(guild_battle, "The battle has been cancelled.")
 
         try:
             await interaction.response.defer()
         except discord.errors.InteractionResponded:
             pass
         await interaction.message.edit(embed=embed, view=create_disabled_buttons())
-        self.battles[interaction.guild_id] = None
+        self.metrics.incr("battles_cancelled")
+        self.close_battle(battle_id)
 
     @app_commands.command()
-    async def start(self, interaction: discord.Interaction, opponent: discord.Member, max_size: int = 4):
+    async def start(
+        self,
+        interaction: discord.Interaction,
+        opponent: discord.Member,
+        max_size: int = 4,
+        instant: bool = False,
+    ):
         """
         Start a new battle with a chosen user.
+
+        Parameters
+        ----------
+        opponent: discord.Member
+            The user you want to battle.
+        max_size: int
+            The maximum amount of balls in each deck.
+        instant: bool
+            Skip the turn by turn display and get the result with the full log right away.
         """
-        if self.battles.get(interaction.guild_id):
+        if self.get_battle(interaction.user):
             await interaction.response.send_message(
-                "You cannot start a new battle right now, as one is already ongoing in this server.",
+                "You cannot start a new battle right now, as you are already in one.",
                 ephemeral=True,
             )
             return
-        self.battles[interaction.guild_id] = GuildBattle(
-            author=interaction.user, opponent=opponent, deck_size=max_size
+        if self.get_battle(opponent):
+            await interaction.response.send_message(
+                f"{opponent.name} is already in a battle!", ephemeral=True
+            )
+            return
+        guild_battle, embed, view = self.new_battle(
+            interaction, interaction.user, opponent, max_size, instant
+        )
+        await interaction.response.send_message(
+            f"Hey, {opponent.mention}, {interaction.user.name} is proposing a battle with you!",
+            embed=embed,
+            view=view,
         )
-        embed = update_embed([], [], interaction.user.name, opponent.name, False, False, max_size)
+
+    def new_battle(
+        self,
+        interaction: discord.Interaction,
+        author: discord.Member,
+        opponent: discord.Member,
+        max_size: int,
+        instant: bool,
+    ) -> Tuple[GuildBattle, discord.Embed, discord.ui.View]:
+        """
+        Opens a battle plan hosted by the response of `interaction`,
+        and returns the embed and buttons to send it with.
+        """
+        # a queue message hosting a matched plan was created minutes ago
+        age = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+        guild_battle = GuildBattle(
+            id=interaction.id,
+            channel_id=interaction.channel_id,
+            created_at=time.monotonic() - max(age, 0),
+            author=author,
+            opponent=opponent,
+            deck_size=max_size,
+            instant=instant,
+        )
+        embed = update_embed([], [], author.name, opponent.name, False, False, max_size)
 
         start_button = discord.ui.Button(
             style=discord.ButtonStyle.success, emoji="✔", label="Ready"
@@ -284,33 +688,30 @@ class Battle(commands.GroupCog):
             style=discord.ButtonStyle.danger, emoji="✖", label="Cancel"
         )
 
-        start_button.callback = self.start_battle
-        cancel_button.callback = self.cancel_battle
+        start_button.callback = partial(self.start_battle, guild_battle.id)
+        cancel_button.callback = partial(self.cancel_battle, guild_battle.id)
 
         view = discord.ui.View(timeout=None)
         view.add_item(start_button)
         view.add_item(cancel_button)
 
-        await interaction.response.send_message(
-            f"Hey, {opponent.mention}, {interaction.user.name} is proposing a battle with you!",
-            embed=embed,
-            view=view,
-        )
-
-        self.interactions[interaction.guild_id] = interaction
+        self.open_battle(guild_battle, interaction)
+        self.metrics.incr("battles_started")
+        return guild_battle, embed, view
 
-    @app_commands.command()
-    async def add(
-        self, interaction: discord.Interaction, countryball: BallInstanceTransform
-    ):
+    async def get_deck(
+        self, interaction: discord.Interaction
+    ) -> Tuple[Optional[GuildBattle], Dict[int, BattleBall]]:
         """
-        Add a ball to a battle.
+        Returns the battle and the deck the user can still edit, keyed by ball ID.
+        If they can't edit any, tells them why and returns no battle.
         """
-        guild_battle = self.battles.get(interaction.guild_id)
+        guild_battle = self.get_battle(interaction.user)
         if not guild_battle:
             await interaction.response.send_message(
-                "There is no ongoing battle in this server!", ephemeral=True
+                "You aren't a part of any ongoing battle!", ephemeral=True
             )
+            return None, {}
 
         if (interaction.user == guild_battle.author and guild_battle.author_ready) or (
             interaction.user == guild_battle.opponent and guild_battle.opponent_ready
@@ -318,124 +719,812 @@ class Battle(commands.GroupCog):
             await interaction.response.send_message(
                 "You cannot change your balls as you are already ready.", ephemeral=True
             )
-            return
+            return None, {}
 
         if interaction.user not in (guild_battle.author, guild_battle.opponent):
             await interaction.response.send_message(
                 "You aren't a part of this battle!", ephemeral=True
             )
+            return None, {}
+
+        guild_battle.last_activity = time.monotonic()
+        deck = (
+            guild_battle.battle.p1_deck
+            if interaction.user == guild_battle.author
+            else guild_battle.battle.p2_deck
+        )
+        return guild_battle, deck
+
+    def deck_closed(self, guild_battle: GuildBattle, user: discord.abc.User) -> Optional[str]:
+        """
+        Tells why the deck of `user` can't be changed anymore, if so. For commands
+        that await something between get_deck and changing the deck.
+        """
+        if self.battles.get(guild_battle.id) is not guild_battle or guild_battle.running:
+            return "The battle plan is over, your deck was not changed."
+        if (user == guild_battle.author and guild_battle.author_ready) or (
+            user == guild_battle.opponent and guild_battle.opponent_ready
+        ):
+            return "You cannot change your balls as you are already ready."
+        return None
+
+    def build_ball(self, countryball: BallInstance, user: discord.abc.User) -> BattleBall:
+        metadata = self.ball_cache.get(countryball.ball_id)
+        return BattleBall(
+            metadata.country,
+            user.name,
+            countryball.health,
+            countryball.attack,
+            metadata.emoji,
+        )
+
+    def describe(self, countryball: BallInstance) -> str:
+        return gen_instance_text(countryball, self.ball_cache.get(countryball.ball_id).country)
+
+    def schedule_setup_update(self, guild_battle: GuildBattle):
+        """
+        Refreshes the battle plan message shortly, changes made in the meantime
+        are sent in the same edit.
+        """
+        if guild_battle.setup_update is None:
+            guild_battle.setup_update = asyncio.create_task(
+                self.update_setup(guild_battle.id)
+            )
+
+    async def update_setup(self, battle_id: int):
+        await asyncio.sleep(SETUP_EDIT_DELAY)
+        guild_battle = self.battles.get(battle_id)
+        interaction = self.interactions.get(battle_id)
+        if not guild_battle or not interaction:
+            return
+        # changes from now on need a new edit
+        guild_battle.setup_update = None
+        if guild_battle.running:
             return
 
-        user_balls = guild_battle.battle.p1_balls if interaction.user == guild_battle.author else guild_battle.battle.p2_balls
+        try:
+            await interaction.edit_original_response(
+                embed=update_embed(
+                    guild_battle.battle.p1_deck.values(),
+                    guild_battle.battle.p2_deck.values(),
+                    guild_battle.author.name,
+                    guild_battle.opponent.name,
+                    guild_battle.author_ready,
+                    guild_battle.opponent_ready,
+                    guild_battle.deck_size,
+                )
+            )
+        except discord.HTTPException:
+            log.warning(f"Failed to update the plan of battle {battle_id}", exc_info=True)
+
+    async def fetch_balls(
+        self,
+        interaction: discord.Interaction,
+        ids: Optional[str],
+        countryball: Optional[Ball],
+    ) -> Optional[List[BallInstance]]:
+        """
+        Fetches the user's balls matching the given IDs or countryball in one query.
+        Sends an error and returns None if the IDs are invalid or missing.
+        """
+        query = BallInstance.filter(player__discord_id=interaction.user.id)
+        if ids:
+            try:
+                wanted = [int(value.lstrip("#")) for value in ids.replace(",", " ").split()]
+            except ValueError:
+                await interaction.response.send_message(
+                    "The IDs must be numbers separated by spaces or commas.", ephemeral=True
+                )
+                return None
+            query = query.filter(id__in=wanted)
+        elif countryball:
+            query = query.filter(ball=countryball)
+        else:
+            await interaction.response.send_message(
+                "You must give some IDs or a countryball.", ephemeral=True
+            )
+            return None
+
+        instances = await query
+        if ids:
+            missing = set(wanted) - {instance.id for instance in instances}
+            if missing:
+                await interaction.response.send_message(
+                    "You don't own these balls: "
+                    + ", ".join(f"#{ball_id}" for ball_id in sorted(missing)),
+                    ephemeral=True,
+                )
+                return None
+        return instances
 
-        if len(user_balls) >= guild_battle.deck_size:
+    @app_commands.command()
+    async def add(
+        self, interaction: discord.Interaction, countryball: BallInstanceTransform
+    ):
+        """
+        Add a ball to a battle.
+        """
+        guild_battle, deck = await self.get_deck(interaction)
+        if not guild_battle:
+            return
+
+        if len(deck) >= guild_battle.deck_size:
             await interaction.response.send_message(
                 f"You cannot add more than {guild_battle.deck_size} balls!", ephemeral=True
             )
             return
 
-        ball = BattleBall(
-            countryball.countryball.country,
-            interaction.user.name,
-            countryball.health,
-            countryball.attack,
-            self.bot.get_emoji(countryball.countryball.emoji_id),
+        if countryball.id in deck:
+            await interaction.response.send_message(
+                "You cannot add the same ball twice!", ephemeral=True
+            )
+            return
+        deck[countryball.id] = self.build_ball(countryball, interaction.user)
+
+        await interaction.response.send_message(
+            f"Added `{self.describe(countryball)}`!",
+            ephemeral=True,
         )
+        self.schedule_setup_update(guild_battle)
+
+    @app_commands.command()
+    async def remove(
+        self, interaction: discord.Interaction, countryball: BallInstanceTransform
+    ):
+        """
+        Remove a ball from a battle.
+        """
+        guild_battle, deck = await self.get_deck(interaction)
+        if not guild_battle:
+            return
+
+        if deck.pop(countryball.id, None):
 
-        if ball in user_balls:
             await interaction.response.send_message(
-                "You cannot add the same ball twice!", ephemeral=True
+                f"Removed `{self.describe(countryball)}`!",
+                ephemeral=True,
+            )
+            self.schedule_setup_update(guild_battle)
+        else:
+            await interaction.response.send_message(
+                f"That ball is not in your deck!", ephemeral=True
             )
+
+    bulk = app_commands.Group(name="bulk", description="Add or remove several balls at once")
+
+    @bulk.command(name="add")
+    async def bulk_add(
+        self,
+        interaction: discord.Interaction,
+        ids: Optional[str] = None,
+        countryball: Optional[BallTransform] = None,
+    ):
+        """
+        Add several balls to a battle at once.
+
+        Parameters
+        ----------
+        ids: str
+            The IDs of the balls to add, separated by spaces or commas.
+        countryball: Ball
+            Add your strongest balls of this countryball until your deck is full.
+        """
+        guild_battle, deck = await self.get_deck(interaction)
+        if not guild_battle:
+            return
+        instances = await self.fetch_balls(interaction, ids, countryball)
+        if instances is None:
+            return
+        # the player may have pressed Ready or the plan may have ended during the query
+        reason = self.deck_closed(guild_battle, interaction.user)
+        if reason:
+            await interaction.response.send_message(reason, ephemeral=True)
             return
-        user_balls.append(ball)
 
-        attack_sign = "+" if countryball.attack_bonus >= 0 else ""
-        health_sign = "+" if countryball.health_bonus >= 0 else ""
+        free = guild_battle.deck_size - len(deck)
+        if not ids:
+            instances = [instance for instance in instances if instance.id not in deck]
+            instances.sort(key=lambda instance: instance.attack + instance.health, reverse=True)
+            instances = instances[:free]
+        elif len(instances) > free:
+            await interaction.response.send_message(
+                f"You cannot add more than {guild_battle.deck_size} balls!", ephemeral=True
+            )
+            return
 
+        # check everything first so that the deck is only changed if every ball fits
+        duplicates = [instance for instance in instances if instance.id in deck]
+        if duplicates:
+            await interaction.response.send_message(
+                "You cannot add the same ball twice: "
+                + ", ".join(f"`{self.describe(instance)}`" for instance in duplicates),
+                ephemeral=True,
+            )
+            return
+        if not instances:
+            await interaction.response.send_message("No ball to add.", ephemeral=True)
+            return
+
+        for instance in instances:
+            deck[instance.id] = self.build_ball(instance, interaction.user)
         await interaction.response.send_message(
-            f"Added `#{countryball.id} {countryball.countryball.country} ({attack_sign}{countryball.attack_bonus}%/{health_sign}{countryball.health_bonus}%)`!",
+            "Added "
+            + ", ".join(f"`{self.describe(instance)}`" for instance in instances)
+            + "!",
             ephemeral=True,
         )
+        self.schedule_setup_update(guild_battle)
+
+    @bulk.command(name="remove")
+    async def bulk_remove(
+        self,
+        interaction: discord.Interaction,
+        ids: Optional[str] = None,
+        countryball: Optional[BallTransform] = None,
+    ):
+        """
+        Remove several balls from a battle at once.
+
+        Parameters
+        ----------
+        ids: str
+            The IDs of the balls to remove, separated by spaces or commas.
+        countryball: Ball
+            Remove all of your balls of this countryball.
+        """
+        guild_battle, deck = await self.get_deck(interaction)
+        if not guild_battle:
+            return
+        instances = await self.fetch_balls(interaction, ids, countryball)
+        if instances is None:
+            return
+        # the player may have pressed Ready or the plan may have ended during the query
+        reason = self.deck_closed(guild_battle, interaction.user)
+        if reason:
+            await interaction.response.send_message(reason, ephemeral=True)
+            return
 
-        await self.interactions[interaction.guild_id].edit_original_response(
-            embed=update_embed(
-                guild_battle.battle.p1_balls,
-                guild_battle.battle.p2_balls,
-                guild_battle.author.name,
-                guild_battle.opponent.name,
-                guild_battle.author_ready,
-                guild_battle.opponent_ready,
-                guild_battle.deck_size,
+        if ids:
+            missing = [instance for instance in instances if instance.id not in deck]
+            if missing:
+                await interaction.response.send_message(
+                    "These balls are not in your deck: "
+                    + ", ".join(f"`{self.describe(instance)}`" for instance in missing),
+                    ephemeral=True,
+                )
+                return
+
+        removed = [instance for instance in instances if deck.pop(instance.id, None)]
+        if not removed:
+            await interaction.response.send_message(
+                "None of these balls are in your deck!", ephemeral=True
             )
+            return
+
+        await interaction.response.send_message(
+            "Removed "
+            + ", ".join(f"`{self.describe(instance)}`" for instance in removed)
+            + "!",
+            ephemeral=True,
         )
+        self.schedule_setup_update(guild_battle)
 
     @app_commands.command()
-    async def remove(
-        self, interaction: discord.Interaction, countryball: BallInstanceTransform
+    async def autodeck(
+        self, interaction: discord.Interaction, apply: bool = False, size: Optional[int] = None
     ):
         """
-        Remove a ball from a battle.
+        Find your strongest deck against your opponent's deck, or against common decks.
+
+        Parameters
+        ----------
+        apply: bool
+            Replace your deck in the battle you are planning with the one found.
+        size: int
+            The amount of balls to pick, the deck size of your battle by default.
         """
-        guild_battle = self.battles.get(interaction.guild_id)
-        if not guild_battle:
+        if apply:
+            guild_battle, deck = await self.get_deck(interaction)
+            if not guild_battle:
+                return
+        else:
+            guild_battle = self.get_battle(interaction.user)
+            if guild_battle and guild_battle.running:
+                guild_battle = None
+        if size is None:
+            size = guild_battle.deck_size if guild_battle else 4
+        if guild_battle:
+            size = min(size, guild_battle.deck_size)
+        if size < 1:
             await interaction.response.send_message(
-                "There is no ongoing battle in this server!", ephemeral=True
+                "The deck must have at least one ball.", ephemeral=True
             )
             return
 
-        if (interaction.user == guild_battle.author and guild_battle.author_ready) or (
-            interaction.user == guild_battle.opponent and guild_battle.opponent_ready
-        ):
+        opponent_deck = None
+        if guild_battle:
+            opponent_deck = (
+                guild_battle.battle.p2_deck
+                if interaction.user == guild_battle.author
+                else guild_battle.battle.p1_deck
+            )
+        if opponent_deck:
+            opponents = [[(ball.health, ball.attack) for ball in opponent_deck.values()]]
+            against = "your opponent's deck"
+        else:
+            opponents = reference_meta(size)
+            against = "common decks"
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        instances = {
+            instance.id: instance
+            for instance in await BallInstance.filter(player__discord_id=interaction.user.id)
+        }
+        if not instances:
+            await interaction.followup.send("You don't have any ball!", ephemeral=True)
+            return
+
+        # the search is CPU bound, never run it on the event loop
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            self.executor,
+            optimize_deck,
+            [(instance.id, instance.health, instance.attack) for instance in instances.values()],
+            opponents,
+            size,
+        )
+        picked = [instances[instance_id] for instance_id in result.ids]
+
+        text = (
+            f"Best deck found against {against} "
+            f"({result.win_rate:.1%} wins over {result.decks_evaluated} decks tried):\n"
+            + "\n".join(f"- `{self.describe(instance)}`" for instance in picked)
+        )
+        if apply:
+            # the battle may have started or been cancelled during the search
+            if self.battles.get(guild_battle.id) is not guild_battle or guild_battle.running:
+                text += "\nThe battle plan is over, your deck was not changed."
+            elif (interaction.user == guild_battle.author and guild_battle.author_ready) or (
+                interaction.user == guild_battle.opponent and guild_battle.opponent_ready
+            ):
+                text += "\nYou are already ready, your deck was not changed."
+            else:
+                deck.clear()
+                for instance in picked:
+                    deck[instance.id] = self.build_ball(instance, interaction.user)
+                guild_battle.last_activity = time.monotonic()
+                self.schedule_setup_update(guild_battle)
+                text += "\nYour deck has been replaced."
+        await interaction.followup.send(text, ephemeral=True)
+
+    @app_commands.command()
+    async def queue(self, interaction: discord.Interaction, max_size: int = 4):
+        """
+        Find an opponent of your level in this server.
+
+        Parameters
+        ----------
+        max_size: int
+            The maximum amount of balls in each deck, players are only matched on the same.
+        """
+        if self.get_battle(interaction.user):
             await interaction.response.send_message(
-                "You cannot change your balls as you are already ready.", ephemeral=True
+                "You cannot queue right now, as you are already in a battle.", ephemeral=True
+            )
+            return
+        if not interaction.guild_id:
+            await interaction.response.send_message(
+                "You can only queue in a server.", ephemeral=True
             )
             return
 
-        if interaction.user not in (guild_battle.author, guild_battle.opponent):
+        rating = await self.results.get_rating(interaction.user.id)
+        previous = self.matchmaker.leave(interaction.user.id)
+        opponent = self.matchmaker.join(
+            QueueEntry(
+                interaction.user.id,
+                (interaction.guild_id, max_size),
+                rating.rating,
+                interaction,
+            )
+        )
+        if previous:
+            try:
+                await previous.data.delete_original_response()
+            except discord.HTTPException:
+                pass
+        if opponent:
+            await self.host_match(interaction, opponent.data, max_size, respond=True)
+            return
+        await interaction.response.send_message(
+            f"{interaction.user.mention} is looking for a battle with up to **{max_size}** "
+            f"balls (rating {rating.rating:.0f}). Use `/battle queue` to take them on!",
+            allowed_mentions=discord.AllowedMentions.none(),
+        )
+
+    @app_commands.command()
+    async def unqueue(self, interaction: discord.Interaction):
+        """
+        Stop looking for an opponent.
+        """
+        entry = self.matchmaker.leave(interaction.user.id)
+        if not entry:
+            await interaction.response.send_message("You aren't in the queue!", ephemeral=True)
+            return
+        await interaction.response.send_message("You left the queue.", ephemeral=True)
+        try:
+            await entry.data.delete_original_response()
+        except discord.HTTPException:
+            pass
+
+    @app_commands.command()
+    async def spectate(self, interaction: discord.Interaction, player: discord.Member):
+        """
+        Mirror the live battle of a player in this channel.
+
+        Parameters
+        ----------
+        player: discord.Member
+            A player of the battle you want to watch.
+        """
+        guild_battle = self.get_battle(player)
+        if not guild_battle or not guild_battle.running:
             await interaction.response.send_message(
-                "You aren't a part of this battle!", ephemeral=True
+                f"{player.name} isn't battling right now!", ephemeral=True
+            )
+            return
+        broadcast = guild_battle.broadcast
+        if guild_battle.instant or broadcast is None:
+            await interaction.response.send_message(
+                "This battle isn't played live, there is nothing to watch.", ephemeral=True
+            )
+            return
+        streams = [stream for stream in broadcast.streams if not stream.closed]
+        if any(stream.message.channel.id == interaction.channel_id for stream in streams):
+            await interaction.response.send_message(
+                "This battle is already shown in this channel!", ephemeral=True
+            )
+            return
+        # the battle message itself is the first stream
+        if len(streams) > MAX_SPECTATORS:
+            await interaction.response.send_message(
+                f"This battle is already mirrored in {MAX_SPECTATORS} channels.", ephemeral=True
             )
             return
 
-        user_balls = (
-            guild_battle.battle.p1_balls
-            if interaction.user == guild_battle.author
-            else guild_battle.battle.p2_balls
+        # sent from the bot rather than as a response, which can't be edited after 15 minutes
+        try:
+            message = await interaction.channel.send(embed=broadcast.frame())
+        except discord.HTTPException:
+            await interaction.response.send_message(
+                "I can't send messages in this channel.", ephemeral=True
+            )
+            return
+        if guild_battle.broadcast is not broadcast:
+            # the battle ended while the message was sent
+            try:
+                await message.delete()
+            except discord.HTTPException:
+                pass
+            await interaction.response.send_message(
+                "This battle has just ended!", ephemeral=True
+            )
+            return
+        broadcast.add(message)
+        await interaction.response.send_message(
+            f"Now showing the battle of {guild_battle.author.name} and "
+            f"{guild_battle.opponent.name}.",
+            ephemeral=True,
         )
 
-        ball_to_remove = BattleBall(
-            countryball.countryball.country,
-            interaction.user.name,
-            countryball.health,
-            countryball.attack,
-            self.bot.get_emoji(countryball.countryball.emoji_id),
+    async def get_odds(self, battle: BattleInstance) -> Tuple[float, float]:
+        """
+        Returns the odds of both decks as given by estimate_odds.
+        Results are cached by deck stats, the work is done in the process pool if any.
+        """
+        p1_stats = deck_stats(battle.p1_deck.values())
+        p2_stats = deck_stats(battle.p2_deck.values())
+        key = (
+            tuple((health, attack) for _, _, health, attack in p1_stats),
+            tuple((health, attack) for _, _, health, attack in p2_stats),
         )
+        if key in self.odds_cache:
+            self.odds_cache.move_to_end(key)
+            return self.odds_cache[key]
 
-        if ball_to_remove in user_balls:
-            user_balls.remove(ball_to_remove)
+        if self.executor is None:
+            odds = estimate_odds(p1_stats, p2_stats)
+        else:
+            loop = asyncio.get_running_loop()
+            odds = await loop.run_in_executor(self.executor, estimate_odds, p1_stats, p2_stats)
+        self.odds_cache[key] = odds
+        if len(self.odds_cache) > ODDS_CACHE_SIZE:
+            self.odds_cache.popitem(last=False)
+        return odds
 
-            attack_sign = "+" if countryball.attack_bonus >= 0 else ""
-            health_sign = "+" if countryball.health_bonus >= 0 else ""
+    @app_commands.command()
+    async def odds(self, interaction: discord.Interaction):
+        """
+        Show the chances of each deck to win the battle you are planning.
+        """
+        guild_battle = self.get_battle(interaction.user)
+        if not guild_battle:
+            await interaction.response.send_message(
+                "You aren't a part of any ongoing battle!", ephemeral=True
+            )
+            return
+        if guild_battle.running:
+            await interaction.response.send_message(
+                "The battle has already started!", ephemeral=True
+            )
+            return
+        battle = guild_battle.battle
+        if not battle.p1_deck or not battle.p2_deck:
+            await interaction.response.send_message(
+                "Both players need at least one ball in their deck.", ephemeral=True
+            )
+            return
 
+        # big decks can take a few seconds to simulate
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        p1, p2 = await self.get_odds(battle)
+        text = (
+            f"**{guild_battle.author.name}**: {p1:.1%}\n"
+            f"**{guild_battle.opponent.name}**: {p2:.1%}"
+        )
+        if 1 - p1 - p2 >= 0.0005:
+            text += f"\nNo winner: {1 - p1 - p2:.1%}"
+        text += f"\n-# Estimated over {ODDS_BATTLES:,} simulated battles."
+        await interaction.followup.send(text, ephemeral=True)
+
+    @app_commands.command()
+    async def leaderboard(self, interaction: discord.Interaction):
+        """
+        Show the best battlers.
+        """
+        top = self.results.leaderboard()
+        embed = discord.Embed(title="Battle leaderboard", color=discord.Colour.blurple())
+        if top:
+            embed.description = "\n".join(
+                f"{i}. <@{rating.discord_id}>: **{rating.rating:.0f}** "
+                f"({rating.wins}W {rating.losses}L {rating.draws}D)"
+                for i, rating in enumerate(top, 1)
+            )
+        else:
+            embed.description = "Nobody has battled yet!"
+        rating = self.results.ratings.get(interaction.user.id)
+        if rating:
+            embed.set_footer(text=f"Your rating: {rating.rating:.0f}")
+        await interaction.response.send_message(
+            embed=embed, allowed_mentions=discord.AllowedMentions.none()
+        )
+
+    @app_commands.command()
+    @app_commands.checks.has_any_role(*settings.root_role_ids, *settings.admin_role_ids)
+    async def stats(self, interaction: discord.Interaction):
+        """
+        Show the battle performance metrics (admin only).
+        """
+        gauges = self.gauges()
+        counters = self.metrics.counters
+        histograms = self.metrics.histograms
+
+        embed = discord.Embed(title="Battle stats", color=discord.Colour.blurple())
+        embed.add_field(
+            name="Battles",
+            value=(
+                f"Active: {gauges['active_battles']}\n"
+                f"Started: {counters['battles_started']}\n"
+                f"Finished: {counters['battles_finished']}\n"
+                f"Cancelled: {counters['battles_cancelled']}"
+            ),
+        )
+        embed.add_field(
+            name="Memory",
+            value=(
+                f"Battles: {gauges['battles_memory_bytes'] / 1024:.1f} KiB\n"
+                f"Interactions: {gauges['interactions_memory_bytes'] / 1024:.1f} KiB\n"
+                f"Render backlog: {gauges['render_backlog_turns']} turns"
+            ),
+        )
+        for name, title, unit in (
+            ("simulation_seconds_per_turn", "Simulation per turn", 1_000_000),
+            ("message_edit_seconds", "Message edit", 1000),
+            ("turn_sleep_drift_seconds", "Turn sleep drift", 1000),
+        ):
+            histogram = histograms[name]
+            suffix = "µs" if unit == 1_000_000 else "ms"
+            embed.add_field(
+                name=title,
+                value=(
+                    f"Count: {histogram.count}\n"
+                    f"Mean: {histogram.mean * unit:.1f}{suffix}\n"
+                    f"p50: ≤{histogram.quantile(0.5) * unit:g}{suffix}\n"
+                    f"p99: ≤{histogram.quantile(0.99) * unit:g}{suffix}"
+                ),
+            )
+        embed.set_footer(
+            text=f"{counters['message_edits']} edits, {counters['message_edit_errors']} "
+            f"failed, {counters['rate_limits']} rate limited, "
+            f"{counters['frames_rendered']} frames rendered"
+        )
+
+        dump = io.BytesIO(self.metrics.to_prometheus(gauges).encode())
+        await interaction.response.send_message(
+            embed=embed, file=discord.File(dump, filename="battle_metrics.txt"), ephemeral=True
+        )
+
+    tournament = app_commands.Group(
+        name="tournament", description="Run a tournament between many decks"
+    )
+
+    def get_tournament(self, interaction: discord.Interaction) -> Optional[Tournament]:
+        return self.tournaments.get(interaction.channel_id)
+
+    @tournament.command(name="create")
+    @app_commands.checks.has_permissions(manage_guild=True)
+    async def tournament_create(
+        self,
+        interaction: discord.Interaction,
+        name: str,
+        format: Literal["round_robin", "elimination"] = "elimination",
+        deck_size: int = 4,
+    ):
+        """
+        Open a tournament in this channel.
+
+        Parameters
+        ----------
+        name: str
+            The name of the tournament.
+        format: str
+            Everyone battles everyone (round_robin), or losers are out (elimination).
+        deck_size: int
+            The maximum amount of balls in each deck.
+        """
+        if self.get_tournament(interaction):
             await interaction.response.send_message(
-                f"Removed `#{countryball.id} {countryball.countryball.country} ({attack_sign}{countryball.attack_bonus}%/{health_sign}{countryball.health_bonus}%)`!",
-                ephemeral=True,
+                "There is already a tournament in this channel!", ephemeral=True
             )
+            return
+        self.tournaments[interaction.channel_id] = Tournament(name, format, deck_size)
+        await interaction.response.send_message(
+            f"The **{name}** tournament is open! Register your deck of up to **{deck_size}** "
+            "balls with `/battle tournament join`."
+        )
 
-            await self.interactions[interaction.guild_id].edit_original_response(
-                embed=update_embed(
-                    guild_battle.battle.p1_balls,
-                    guild_battle.battle.p2_balls,
-                    guild_battle.author.name,
-                    guild_battle.opponent.name,
-                    guild_battle.author_ready,
-                    guild_battle.opponent_ready,
-                    guild_battle.deck_size,
-                )
+    @tournament.command(name="join")
+    async def tournament_join(
+        self,
+        interaction: discord.Interaction,
+        ids: Optional[str] = None,
+        countryball: Optional[BallTransform] = None,
+    ):
+        """
+        Register a deck in the tournament of this channel, or replace yours.
+
+        Parameters
+        ----------
+        ids: str
+            The IDs of the balls of your deck, separated by spaces or commas.
+        countryball: Ball
+            Register your strongest balls of this countryball.
+        """
+        tournament = self.get_tournament(interaction)
+        if not tournament or tournament.running or tournament.finished:
+            await interaction.response.send_message(
+                "There is no tournament open in this channel.", ephemeral=True
+            )
+            return
+        instances = await self.fetch_balls(interaction, ids, countryball)
+        if instances is None:
+            return
+        if not ids:
+            instances.sort(key=lambda instance: instance.attack + instance.health, reverse=True)
+            instances = instances[: tournament.deck_size]
+        if not instances:
+            await interaction.response.send_message("No ball to register.", ephemeral=True)
+            return
+        if len(instances) > tournament.deck_size:
+            await interaction.response.send_message(
+                f"You cannot register more than {tournament.deck_size} balls!", ephemeral=True
+            )
+            return
+        # the registration might have closed while fetching the balls
+        if tournament.running or tournament.finished:
+            await interaction.response.send_message(
+                "The tournament has already started!", ephemeral=True
+            )
+            return
+
+        tournament.register(
+            interaction.user.id,
+            interaction.user.name,
+            deck_stats([self.build_ball(instance, interaction.user) for instance in instances]),
+        )
+        await interaction.response.send_message(
+            "Registered "
+            + ", ".join(f"`{self.describe(instance)}`" for instance in instances)
+            + f"! {len(tournament.entrants)} entrants so far.",
+            ephemeral=True,
+        )
+
+    @tournament.command(name="leave")
+    async def tournament_leave(self, interaction: discord.Interaction):
+        """
+        Withdraw your deck from the tournament of this channel.
+        """
+        tournament = self.get_tournament(interaction)
+        if not tournament or tournament.running or tournament.finished:
+            await interaction.response.send_message(
+                "There is no tournament open in this channel.", ephemeral=True
             )
+            return
+        if tournament.unregister(interaction.user.id):
+            await interaction.response.send_message("Your deck was withdrawn.", ephemeral=True)
         else:
             await interaction.response.send_message(
-                f"That ball is not in your deck!", ephemeral=True
+                "You aren't registered in this tournament!", ephemeral=True
+            )
+
+    @tournament.command(name="cancel")
+    @app_commands.checks.has_permissions(manage_guild=True)
+    async def tournament_cancel(self, interaction: discord.Interaction):
+        """
+        Cancel the tournament of this channel before it starts.
+        """
+        tournament = self.get_tournament(interaction)
+        if not tournament or tournament.running:
+            await interaction.response.send_message(
+                "There is no tournament to cancel in this channel.", ephemeral=True
+            )
+            return
+        del self.tournaments[interaction.channel_id]
+        await interaction.response.send_message(
+            f"The **{tournament.name}** tournament was cancelled."
+        )
+
+    @tournament.command(name="start")
+    @app_commands.checks.has_permissions(manage_guild=True)
+    async def tournament_start(self, interaction: discord.Interaction):
+        """
+        Close the registrations and play every match of the tournament of this channel.
+        """
+        tournament = self.get_tournament(interaction)
+        if not tournament or tournament.running or tournament.finished:
+            await interaction.response.send_message(
+                "There is no tournament open in this channel.", ephemeral=True
             )
+            return
+        if len(tournament.entrants) < 2:
+            await interaction.response.send_message(
+                "A tournament needs at least two entrants!", ephemeral=True
+            )
+            return
 
+        await interaction.response.send_message(
+            f"Starting **{tournament.name}** with {len(tournament.entrants)} entrants!"
+        )
+        # a channel message rather than a followup, big events can outlive the interaction
+        message = await interaction.channel.send(embed=tournament_embed(tournament, []))
+        stream = self.render_scheduler.open(
+            message, lambda results: tournament_embed(tournament, results)
+        )
+
+        def on_result(match: Match):
+            if match.p2 is None:
+                return
+            if match.winner:
+                stream.push(
+                    f"**{match.winner.name}** beat {match.loser.name} in {match.turns} turns"
+                )
+            else:
+                stream.push(f"{match.p1.name} and {match.p2.name} drew")
 
+        try:
+            await tournament.run(self.executor, on_result)
+            await stream.flush()
+        finally:
+            stream.close()
+            self.tournaments.pop(interaction.channel_id, None)
+        await message.edit(embed=tournament_embed(tournament, []))
@@ -0,0 +1,118 @@
+import bisect
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+BASE_WINDOW = 50.0  # rating difference accepted right after joining
+WIDEN_PER_SECOND = 5.0  # the window grows by this much every second of waiting
+MAX_WINDOW = 400.0
+# waiting players are removed after this many seconds, the queue interaction of a
+# matched player then hosts the battle plan for what is left of its 15 minutes
+QUEUE_TIMEOUT = 4 * 60
+
+
+@dataclass
+class QueueEntry:
+    user_id: int
+    pool: Hashable  # only players of the same pool are matched together
+    rating: float
+    data: Any = None  # kept for the caller, the interaction of the player for the cog
+    joined_at: float = field(default_factory=time.monotonic)
+
+    def window(self, now: float) -> float:
+        return min(MAX_WINDOW, BASE_WINDOW + WIDEN_PER_SECOND * (now - self.joined_at))
+
+    @property
+    def key(self) -> Tuple[float, float, int]:
+        """Sorts by rating, unique per player."""
+        return (self.rating, self.joined_at, self.user_id)
+
+
+class Matchmaker:
+    """
+    Waiting players sorted by rating, one sorted list per pool.
+
+    A player is matched with the closest rating of their pool if it is within
+    their search window, which widens the longer they wait. Pools are lists of
+    (key, entry) kept sorted with bisect, so finding a player is O(log n) and
+    only inserting or removing one shifts the list. `sweep` retries every
+    waiting player as their windows widen and drops those who waited too long.
+    """
+
+    def __init__(self):
+        self.pools: Dict[Hashable, List[Tuple[Tuple[float, float, int], QueueEntry]]] = {}
+        self.entries: Dict[int, QueueEntry] = {}  # by user ID, in joining order
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.entries
+
+    def join(self, entry: QueueEntry) -> Optional[QueueEntry]:
+        """
+        Queues a player, or returns the opponent they were matched with right away.
+        A player already in the queue is moved to the new pool.
+        """
+        self.leave(entry.user_id)
+        opponent = self._closest(entry, time.monotonic())
+        if opponent is not None:
+            self._remove(opponent)
+            return opponent
+        # keys are unique, entries themselves are never compared
+        bisect.insort(self.pools.setdefault(entry.pool, []), (entry.key, entry))
+        self.entries[entry.user_id] = entry
+        return None
+
+    def leave(self, user_id: int) -> Optional[QueueEntry]:
+        entry = self.entries.get(user_id)
+        if entry is not None:
+            self._remove(entry)
+        return entry
+
+    def sweep(self) -> Tuple[List[Tuple[QueueEntry, QueueEntry]], List[QueueEntry]]:
+        """
+        Matches the players whose widened window now reaches someone, the ones
+        who waited longest first, and removes the players who timed out.
+        Returns the matched pairs (longest waiting first) and the expired entries.
+        """
+        now = time.monotonic()
+        matches = []
+        expired = []
+        for entry in list(self.entries.values()):
+            if entry.user_id not in self.entries:
+                continue  # matched earlier in this sweep
+            if now - entry.joined_at > QUEUE_TIMEOUT:
+                self._remove(entry)
+                expired.append(entry)
+                continue
+            opponent = self._closest(entry, now)
+            if opponent is not None:
+                self._remove(entry)
+                self._remove(opponent)
+                matches.append((entry, opponent))
+        return matches, expired
+
+    def _remove(self, entry: QueueEntry):
+        del self.entries[entry.user_id]
+        pool = self.pools[entry.pool]
+        del pool[bisect.bisect_left(pool, (entry.key,))]
+        if not pool:
+            del self.pools[entry.pool]
+
+    def _closest(self, entry: QueueEntry, now: float) -> Optional[QueueEntry]:
+        pool = self.pools.get(entry.pool)
+        if not pool:
+            return None
+        index = bisect.bisect_left(pool, (entry.key,))
+        best = None
+        # the closest rating is next to where the entry sorts, skipping itself
+        for _, candidate in pool[max(index - 2, 0) : index + 2]:
+            if candidate is entry:
+                continue
+            gap = abs(candidate.rating - entry.rating)
+            if gap <= entry.window(now) and (
+                best is None or gap < abs(best.rating - entry.rating)
+            ):
+                best = candidate
+        return best
@@ -0,0 +1,67 @@
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Optional
+
+from ballsdex.packages.battle.xe_battle_lib import (
+    ATTACK_MESSAGES,
+    DEFAULT_PACK,
+    DEFEAT_MESSAGES,
+    DODGE_MESSAGES,
+    MessagePack,
+)
+
+log = logging.getLogger("ballsdex.packages.battle.messages")
+
+# default.json replaces the messages of xe_battle_lib, <guild ID>.json those of one server
+PACKS_DIRECTORY = Path(__file__).resolve().parent / "message_packs"
+
+
+def load_pack(path: Path) -> MessagePack:
+    """
+    Loads a pack from a JSON file with "attack", "defeat" and "dodge" lists.
+    Missing lists keep the messages of xe_battle_lib.
+    """
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if not isinstance(data, dict):
+        raise ValueError(f"{path.name} must hold a JSON object")
+    return MessagePack(
+        data.get("attack", ATTACK_MESSAGES),
+        data.get("defeat", DEFEAT_MESSAGES),
+        data.get("dodge", DODGE_MESSAGES),
+    )
+
+
+class MessagePacks:
+    """
+    The message packs of every server, read and compiled once from a directory.
+    Servers without a pack use the default one.
+    """
+
+    def __init__(self, directory: Path = PACKS_DIRECTORY):
+        self.directory = directory
+        self.default = DEFAULT_PACK
+        self.packs: Dict[int, MessagePack] = {}
+
+    def load(self):
+        """(Re)loads every pack, broken files are skipped with an error."""
+        default = DEFAULT_PACK
+        packs: Dict[int, MessagePack] = {}
+        for path in sorted(self.directory.glob("*.json")):
+            if path.stem != "default" and not path.stem.isdigit():
+                log.warning(f"Ignoring message pack {path.name}, not a server ID")
+                continue
+            try:
+                pack = load_pack(path)
+            except (OSError, ValueError, TypeError):
+                log.error(f"Failed to load message pack {path.name}", exc_info=True)
+                continue
+            if path.stem == "default":
+                default = pack
+            else:
+                packs[int(path.stem)] = pack
+        self.default = default
+        self.packs = packs
+
+    def get(self, guild_id: Optional[int]) -> MessagePack:
+        return self.packs.get(guild_id, self.default)
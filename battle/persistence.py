@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+log = logging.getLogger("ballsdex.packages.battle.persistence")
+
+DEFAULT_RATING = 1000.0
+K_FACTOR = 32.0
+QUEUE_SIZE = 10_000  # results waiting to be written, new ones are dropped beyond that
+BATCH_SIZE = 200  # results written per transaction
+FLUSH_INTERVAL = 5.0  # seconds a result may wait for others to share its batch
+RETRY_DELAY = 10.0
+STOP_TIMEOUT = 30.0  # seconds given to the queue to be written when the cog unloads
+LEADERBOARD_SIZE = 10
+LEADERBOARD_CACHE = 3 * LEADERBOARD_SIZE  # ratings kept in memory for the leaderboard
+RATING_CACHE = 10_000  # ratings of recent players kept in memory, others are loaded when needed
+
+# BallsDex only registers the models of its core, so the tables are created here
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS battle_result (
+    id BIGSERIAL PRIMARY KEY,
+    guild_id BIGINT,
+    channel_id BIGINT NOT NULL,
+    player1_id BIGINT NOT NULL,
+    player2_id BIGINT NOT NULL,
+    player1_deck BIGINT[] NOT NULL,
+    player2_deck BIGINT[] NOT NULL,
+    winner_id BIGINT,
+    turns INTEGER NOT NULL,
+    seed BIGINT NOT NULL,
+    finished_at TIMESTAMPTZ NOT NULL
+);
+CREATE TABLE IF NOT EXISTS battle_rating (
+    discord_id BIGINT PRIMARY KEY,
+    rating DOUBLE PRECISION NOT NULL,
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    draws INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX IF NOT EXISTS battle_rating_rating_idx ON battle_rating (rating DESC);
+"""
+INSERT_RESULT = (
+    "INSERT INTO battle_result (guild_id, channel_id, player1_id, player2_id, player1_deck, "
+    "player2_deck, winner_id, turns, seed, finished_at) "
+    "VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)"
+)
+UPSERT_RATING = (
+    "INSERT INTO battle_rating (discord_id, rating, wins, losses, draws, updated_at) "
+    "VALUES ($1, $2, $3, $4, $5, $6) ON CONFLICT (discord_id) DO UPDATE SET "
+    "rating = EXCLUDED.rating, wins = EXCLUDED.wins, losses = EXCLUDED.losses, "
+    "draws = EXCLUDED.draws, updated_at = EXCLUDED.updated_at"
+)
+SELECT_RATINGS = (
+    "SELECT discord_id, rating, wins, losses, draws FROM battle_rating "
+    "WHERE discord_id = ANY($1::BIGINT[])"
+)
+SELECT_TOP = (
+    "SELECT discord_id, rating, wins, losses, draws FROM battle_rating "
+    "ORDER BY rating DESC LIMIT $1"
+)
+
+
+@dataclass
+class BattleRecord:
+    guild_id: Optional[int]
+    channel_id: int
+    player1_id: int
+    player2_id: int
+    player1_deck: List[int]  # ball instance IDs
+    player2_deck: List[int]
+    winner_id: Optional[int]
+    turns: int
+    seed: int
+    finished_at: datetime
+
+
+@dataclass
+class Rating:
+    discord_id: int
+    rating: float = DEFAULT_RATING
+    wins: int = 0
+    losses: int = 0
+    draws: int = 0
+
+
+def expected_score(rating: float, opponent: float) -> float:
+    return 1 / (1 + 10 ** ((opponent - rating) / 400))
+
+
+def update_ratings(player1: Rating, player2: Rating, winner_id: Optional[int]):
+    """Applies the Elo update of one battle to both ratings."""
+    if winner_id == player1.discord_id:
+        score = 1.0
+        player1.wins += 1
+        player2.losses += 1
+    elif winner_id == player2.discord_id:
+        score = 0.0
+        player1.losses += 1
+        player2.wins += 1
+    else:
+        score = 0.5
+        player1.draws += 1
+        player2.draws += 1
+    change = K_FACTOR * (score - expected_score(player1.rating, player2.rating))
+    player1.rating += change
+    player2.rating -= change
+
+
+class ResultWriter:
+    """
+    Write-behind queue of battle results.
+
+    `record` only queues the result, a background task drains the queue in
+    batches: ratings of the players are loaded if unknown, updated in order,
+    and results and ratings are written with one bulk insert each per batch.
+    The top of the leaderboard is kept in memory and updated as ratings change,
+    other ratings only while their players are active.
+    """
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+        self.ratings: OrderedDict = OrderedDict()  # least recently used first
+        self.top: List[Rating] = []
+        # every rating at or above this one is in `top`, None if every rating is
+        self.floor: Optional[float] = None
+        self.written = 0
+        self.dropped = 0
+        self._task: Optional[asyncio.Task] = None
+        self._refresh: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is not None:
+            return
+        connection = Tortoise.get_connection("default")
+        await connection.execute_script(SCHEMA)
+        await self.refresh_top()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the writer once every queued result is written."""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.error(f"Gave up writing {self.queue.qsize()} battle results")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def record(self, record: BattleRecord):
+        """Queues a finished battle, never waits."""
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            log.warning(f"Battle result queue is full, dropped a result of {record.channel_id}")
+
+    @property
+    def backlog(self) -> int:
+        return self.queue.qsize()
+
+    async def refresh_top(self):
+        connection = Tortoise.get_connection("default")
+        rows = await connection.execute_query_dict(SELECT_TOP, [LEADERBOARD_CACHE])
+        # ratings written during the query are more recent than the rows
+        self.top = sorted(
+            (self.ratings.get(row["discord_id"]) or Rating(**row) for row in rows),
+            key=lambda rating: rating.rating,
+            reverse=True,
+        )
+        self.floor = rows[-1]["rating"] if len(rows) >= LEADERBOARD_CACHE else None
+
+    async def get_rating(self, discord_id: int) -> Rating:
+        """Returns the rating of a player, loaded from the database if not known yet."""
+        return (await self._load_ratings([discord_id]))[discord_id]
+
+    def leaderboard(self, size: int = LEADERBOARD_SIZE) -> List[Rating]:
+        return self.top[:size]
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(
+                        await asyncio.wait_for(self.queue.get(), deadline - time.monotonic())
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            while True:
+                try:
+                    await self._write(batch)
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    log.exception(f"Failed to write {len(batch)} battle results, retrying")
+                    await asyncio.sleep(RETRY_DELAY)
+            for _ in batch:
+                self.queue.task_done()
+
+    def _cache(self, rating: Rating):
+        self.ratings[rating.discord_id] = rating
+        self.ratings.move_to_end(rating.discord_id)
+        while len(self.ratings) > RATING_CACHE:
+            self.ratings.popitem(last=False)
+
+    async def _load_ratings(self, discord_ids: Sequence[int]) -> Dict[int, Rating]:
+        """Returns the ratings of these players, loading the ones not in memory."""
+        found: Dict[int, Rating] = {}
+        missing = []
+        for discord_id in discord_ids:
+            if discord_id in self.ratings:
+                self.ratings.move_to_end(discord_id)
+                found[discord_id] = self.ratings[discord_id]
+            else:
+                missing.append(discord_id)
+        if not missing:
+            return found
+        connection = Tortoise.get_connection("default")
+        rows = {
+            row["discord_id"]: row
+            for row in await connection.execute_query_dict(SELECT_RATINGS, [missing])
+        }
+        for discord_id in missing:
+            # a batch written during the query is more recent than the rows
+            rating = self.ratings.get(discord_id)
+            if rating is None:
+                row = rows.get(discord_id)
+                rating = Rating(**row) if row else Rating(discord_id)
+            self._cache(rating)
+            found[discord_id] = rating
+        return found
+
+    async def _write(self, batch: List[BattleRecord]):
+        loaded = await self._load_ratings(
+            list({player for record in batch for player in (record.player1_id, record.player2_id)})
+        )
+        # ratings are updated on copies, the cache only changes once the batch is written
+        ratings: Dict[int, Rating] = {}
+        for record in batch:
+            for player in (record.player1_id, record.player2_id):
+                if player not in ratings:
+                    ratings[player] = replace(loaded[player])
+            update_ratings(
+                ratings[record.player1_id], ratings[record.player2_id], record.winner_id
+            )
+
+        now = datetime.now(timezone.utc)
+        async with in_transaction("default") as transaction:
+            await transaction.execute_many(
+                INSERT_RESULT,
+                [
+                    [
+                        record.guild_id,
+                        record.channel_id,
+                        record.player1_id,
+                        record.player2_id,
+                        record.player1_deck,
+                        record.player2_deck,
+                        record.winner_id,
+                        record.turns,
+                        record.seed,
+                        record.finished_at,
+                    ]
+                    for record in batch
+                ],
+            )
+            await transaction.execute_many(
+                UPSERT_RATING,
+                [
+                    [
+                        rating.discord_id,
+                        rating.rating,
+                        rating.wins,
+                        rating.losses,
+                        rating.draws,
+                        now,
+                    ]
+                    for rating in ratings.values()
+                ],
+            )
+
+        for rating in ratings.values():
+            self._cache(rating)
+        self.written += len(batch)
+        self._update_top(ratings.values())
+
+    def _update_top(self, changed):
+        """Merges the changed ratings in the cached top, refetched if it runs short."""
+        changed = {rating.discord_id: rating for rating in changed}
+        top = [rating for rating in self.top if rating.discord_id not in changed]
+        # under the floor, uncached players may rank higher, leave these out
+        top += [
+            rating
+            for rating in changed.values()
+            if self.floor is None or rating.rating >= self.floor
+        ]
+        top.sort(key=lambda rating: rating.rating, reverse=True)
+        if len(top) > LEADERBOARD_CACHE:
+            top = top[:LEADERBOARD_CACHE]
+            self.floor = top[-1].rating
+        self.top = top
+
+        if self.floor is not None and len(top) < LEADERBOARD_SIZE and self._refresh is None:
+            self._refresh = asyncio.create_task(self.refresh_top())
+            self._refresh.add_done_callback(self._refreshed)
+
+    def _refreshed(self, task: asyncio.Task):
+        self._refresh = None
+        if not task.cancelled() and task.exception():
+            log.error("Failed to refresh the battle leaderboard", exc_info=task.exception())
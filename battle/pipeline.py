@@ -0,0 +1,124 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+from ballsdex.packages.battle.xe_battle_lib import (
+    BattleEvent,
+    BattleInstance,
+    BattleText,
+    MessagePack,
+    play_log,
+)
+
+PIPELINE_QUEUE_SIZE = 32  # turns a consumer may lag behind before the simulation waits for it
+YIELD_EVERY = 64  # turns queued between two yields to the event loop when no queue is full
+
+_DONE = object()
+
+
+class TurnEvent(NamedTuple):
+    """A turn with the health of every ball once it was applied."""
+
+    event: BattleEvent
+    p1_health: Tuple[int, ...]
+    p2_health: Tuple[int, ...]
+    texts: BattleText
+
+    @property
+    def text(self) -> str:
+        """The text of the turn, built on access."""
+        return self.texts.format(self.event)
+
+
+def turn_events(
+    battle: BattleInstance, log, pack: Optional[MessagePack] = None
+) -> Iterable[TurnEvent]:
+    """
+    Plays a log made by simulate_log and yields a TurnEvent per turn.
+    Only the side that was hit gets a new health tuple, the other one is shared.
+    """
+    texts = BattleText(battle, pack)
+    p1_health = tuple(ball.health for ball in battle.p1_balls)
+    p2_health = tuple(ball.health for ball in battle.p2_balls)
+    for event in play_log(battle, log):
+        if not event.dodge:
+            target = event.target
+            if event.side == 1:
+                health = battle.p2_balls[target].health
+                p2_health = p2_health[:target] + (health,) + p2_health[target + 1 :]
+            else:
+                health = battle.p1_balls[target].health
+                p1_health = p1_health[:target] + (health,) + p1_health[target + 1 :]
+        yield TurnEvent(event, p1_health, p2_health, texts)
+
+
+Consumer = Callable[[AsyncIterator[TurnEvent]], Awaitable[None]]
+
+
+async def run_pipeline(
+    events: Iterable[TurnEvent], *consumers: Consumer, maxsize: int = PIPELINE_QUEUE_SIZE
+):
+    """
+    Feeds the events to every consumer through its own bounded queue.
+
+    Consumers read at their own pace, the feeding only waits when a queue is
+    full, so the slowest consumer sets the pace without holding the others back
+    by more than `maxsize` turns. A consumer that stops early doesn't block
+    the others, and if any consumer fails the whole pipeline is cancelled.
+    """
+    queues: List[asyncio.Queue] = [asyncio.Queue(maxsize) for _ in consumers]
+
+    async def feed():
+        for i, item in enumerate(events, 1):
+            for queue in queues:
+                await queue.put(item)
+            if i % YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+        for queue in queues:
+            await queue.put(_DONE)
+
+    async def drain(queue: asyncio.Queue) -> AsyncIterator[TurnEvent]:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            yield item
+
+    async def consume(consumer: Consumer, queue: asyncio.Queue):
+        items = drain(queue)
+        await consumer(items)
+        # keep emptying the queue so that the feeding never waits on it
+        async for _ in items:
+            pass
+
+    tasks = [asyncio.create_task(feed())]
+    tasks += [
+        asyncio.create_task(consume(consumer, queue)) for consumer, queue in zip(consumers, queues)
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+@dataclass
+class BattleSummary:
+    """Totals of a battle per side, filled by its `consume` pipeline consumer."""
+
+    damage: List[int] = field(default_factory=lambda: [0, 0])
+    crits: List[int] = field(default_factory=lambda: [0, 0])
+    dodges: List[int] = field(default_factory=lambda: [0, 0])
+    defeats: List[int] = field(default_factory=lambda: [0, 0])
+
+    async def consume(self, events: AsyncIterator[TurnEvent]):
+        async for turn in events:
+            event = turn.event
+            side = event.side - 1
+            if event.dodge:
+                # the attack was dodged by the other side
+                self.dodges[1 - side] += 1
+                continue
+            self.damage[side] += event.damage
+            self.crits[side] += event.crit
+            self.defeats[side] += event.defeat
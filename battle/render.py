@@ -0,0 +1,415 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+import discord
+
+from ballsdex.packages.battle.stats import BattleStats
+from ballsdex.packages.battle.tournament import ROUND_ROBIN, Tournament
+
+log = logging.getLogger("ballsdex.packages.battle.render")
+
+FIELD_LIMIT = 1024  # max length of an embed field value
+SUMMARY_ROOM = 24  # room kept for the "… and N more" line of truncated decks
+BRACKET_LIMIT = 4000  # characters shared by the round fields of a bracket, embeds stop at 6000
+
+
+def deck_line(ball, health: Optional[int] = None) -> str:
+    """Renders a ball, with `health` instead of its current health if given."""
+    dead = ball.dead if health is None else health <= 0
+    if dead:
+        status = "💀"
+    else:
+        status = f"❤️ {ball.health if health is None else health} | ⚔️ {ball.attack}"
+    return f"- {ball.emoji} {ball.name} ({status})"
+
+
+class DeckRenderer:
+    """
+    Keeps the rendered line of every ball of a deck so that a turn only
+    re-renders the ball it changed. The output always fits in an embed field,
+    balls that don't fit are summed up on a last line.
+    """
+
+    def __init__(self, balls, limit: int = FIELD_LIMIT):
+        self.balls = balls
+        self.limit = limit
+        self.lines = [deck_line(ball) for ball in balls]
+        self._text: Optional[str] = None
+
+    def mark(self, index: int, health: Optional[int] = None):
+        """
+        Re-renders the ball at `index` after its health or dead state changed,
+        with `health` instead of its current health if given.
+        """
+        line = deck_line(self.balls[index], health)
+        if line != self.lines[index]:
+            self.lines[index] = line
+            self._text = None
+
+    def render(self) -> str:
+        if self._text is None:
+            self._text = self._build()
+        return self._text
+
+    def _build(self) -> str:
+        return fit_lines(self.lines, self.limit)
+
+
+def fit_lines(lines: List[str], limit: int = FIELD_LIMIT, empty: str = "Empty") -> str:
+    """Joins as many lines as fit in `limit` characters, the rest are summed up on a last line."""
+    if not lines:
+        return empty
+
+    shown = []
+    length = -1
+    for i, line in enumerate(lines):
+        # unless this is the last line, keep room for the summary line
+        room = limit if i == len(lines) - 1 else limit - SUMMARY_ROOM
+        if length + 1 + len(line) > room:
+            shown.append(f"… and {len(lines) - i} more")
+            break
+        shown.append(line)
+        length += 1 + len(line)
+    return "\n".join(shown)
+
+
+def gen_deck(balls) -> str:
+    """Generates a text representation of the player's deck with live status."""
+    return DeckRenderer(balls).render()
+
+
+def update_embed(
+    author_balls, opponent_balls, author, opponent, author_ready, opponent_ready, max_size: int
+) -> discord.Embed:
+    """Creates an embed for the battle setup phase."""
+    embed = discord.Embed(
+        title="Battle Plan",
+        description=f"Add or remove balls you want to propose to the other player using the '/battle add' and '/battle remove' commands. Remember, you may add up to **{max_size}** balls in a deck for this battle. Once you've finished, click the tick button to start the battle.",
+        color=discord.Colour.blurple(),
+    )
+
+    author_emoji = ":white_check_mark:" if author_ready else ""
+    opponent_emoji = ":white_check_mark:" if opponent_ready else ""
+
+    embed.add_field(
+        name=f"{author_emoji} {author}'s deck:",
+        value=gen_deck(author_balls),
+        inline=True,
+    )
+    embed.add_field(
+        name=f"{opponent_emoji} {opponent}'s deck:",
+        value=gen_deck(opponent_balls),
+        inline=True,
+    )
+    return embed
+
+
+def tournament_embed(tournament: Tournament, latest: List[str]) -> discord.Embed:
+    """Creates the standings or bracket embed of a tournament, with its latest results."""
+    done = tournament.played_matches
+    total = tournament.total_matches
+    if tournament.finished:
+        champion = tournament.champion
+        title = f"{tournament.name}: Complete!"
+        description = f"🏆 **{champion.name}** wins the tournament!" if champion else ""
+        color = discord.Color.green()
+    else:
+        title = f"{tournament.name}: In progress"
+        description = "\n".join(latest) or "Preparing matches..."
+        color = discord.Color.orange()
+    embed = discord.Embed(title=title, description=description, color=color)
+
+    if tournament.format == ROUND_ROBIN:
+        embed.add_field(
+            name="Standings",
+            value=fit_lines(
+                [
+                    f"{i}. {entrant.name}: {entrant.wins}W {entrant.losses}L {entrant.draws}D"
+                    for i, entrant in enumerate(tournament.standings(), 1)
+                ]
+            ),
+            inline=False,
+        )
+    else:
+        # an embed has at most 25 fields, keep the latest rounds
+        rounds = list(enumerate(tournament.rounds, 1))[-25:]
+        limit = min(FIELD_LIMIT, BRACKET_LIMIT // max(len(rounds), 1))
+        for round, matches in rounds:
+            lines = []
+            byes = sum(match.p2 is None for match in matches)
+            for match in matches:
+                if match.p2 is None:
+                    continue
+                if match.winner:
+                    lines.append(f"**{match.winner.name}** beat {match.loser.name}")
+                else:
+                    lines.append(f"{match.p1.name} vs {match.p2.name}")
+            if byes:
+                plural = "s" if byes > 1 else ""
+                lines.append(f"{byes} entrant{plural} went through without playing")
+            embed.add_field(name=f"Round {round}", value=fit_lines(lines, limit), inline=False)
+
+    embed.set_footer(
+        text=f"{tournament.format.replace('_', ' ').title()} | {len(tournament.entrants)} "
+        f"entrants | {done}/{total} matches ({done / total if total else 1:.0%}) | "
+        f"Seed: {tournament.seed}"
+    )
+    return embed
+
+
+class RenderStream:
+    """
+    The pending turns of one live battle message.
+    Turns are pushed as they happen and sent by the RenderScheduler whenever
+    this message gets its share of the edit budget.
+    """
+
+    def __init__(
+        self,
+        scheduler: "RenderScheduler",
+        message: discord.Message,
+        render: Callable[[List[str]], discord.Embed],
+    ):
+        self.scheduler = scheduler
+        self.message = message
+        self.render = render
+        self.pending: List[str] = []
+        self.interval = scheduler.min_interval
+        self.next_at = 0.0
+        self.in_flight = False
+        self.queued = False
+        self.closed = False
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def push(self, text: str):
+        """Queues a turn to be shown on the next edit of this message."""
+        self.pending.append(text)
+        self.idle.clear()
+        self.scheduler._schedule(self)
+
+    async def flush(self):
+        """Waits until every pushed turn has been sent."""
+        await self.idle.wait()
+
+    def close(self):
+        self.closed = True
+        self.pending.clear()
+        self.idle.set()
+
+
+class RenderScheduler:
+    """
+    Cog-wide scheduler for live battle edits.
+
+    Every battle message gets a RenderStream. Streams with pending turns are
+    served round robin under a global edit budget, and each stream keeps its own
+    interval which grows when Discord rate limits it and shrinks back when edits
+    go through quickly. Turns that pile up in the meantime are merged into one edit.
+    """
+
+    def __init__(
+        self,
+        edits_per_second: float = 4.0,
+        min_interval: float = 1.0,
+        max_interval: float = 30.0,
+        max_merged_turns: int = 5,
+        slow_edit: float = 2.0,
+        stats: Optional[BattleStats] = None,
+    ):
+        self.stats = stats or BattleStats()
+        self.edits_per_second = edits_per_second
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_merged_turns = max_merged_turns
+        self.slow_edit = slow_edit
+
+        self._ready: deque = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sends: set = set()
+        self._tokens = edits_per_second
+        self._refilled_at = time.monotonic()
+
+    @property
+    def backlog(self) -> int:
+        return sum(len(stream.pending) for stream in self._ready)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        tasks = [self._task, *self._sends]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        # nothing will send their turns anymore, release whoever waits on a flush
+        while self._ready:
+            stream = self._ready.popleft()
+            stream.queued = False
+            stream.close()
+
+    def open(
+        self, message: discord.Message, render: Callable[[List[str]], discord.Embed]
+    ) -> RenderStream:
+        """
+        Registers a live message. `render` receives the turns merged into the
+        next edit and returns the embed to send.
+        """
+        self.start()
+        return RenderStream(self, message, render)
+
+    def _schedule(self, stream: RenderStream):
+        if not stream.in_flight and not stream.queued:
+            stream.queued = True
+            self._ready.append(stream)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _take_token(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(
+                self.edits_per_second,
+                self._tokens + (now - self._refilled_at) * self.edits_per_second,
+            )
+            self._refilled_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.edits_per_second)
+
+    async def _next_stream(self) -> RenderStream:
+        while True:
+            now = time.monotonic()
+            wait = None
+            for _ in range(len(self._ready)):
+                stream = self._ready.popleft()
+                if stream.closed or stream.in_flight or not stream.pending:
+                    # an edit in flight reschedules its stream once it is done
+                    stream.queued = False
+                    continue
+                if stream.next_at <= now:
+                    stream.queued = False
+                    return stream
+                self._ready.append(stream)
+                delay = stream.next_at - now
+                wait = delay if wait is None else min(wait, delay)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self):
+        while True:
+            stream = await self._next_stream()
+            await self._take_token()
+            if stream.closed or stream.in_flight:
+                # it was closed or queued again and sent while waiting for the token
+                self._tokens += 1
+                continue
+            stream.in_flight = True
+            task = asyncio.create_task(self._send(stream))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    async def _send(self, stream: RenderStream):
+        turns, stream.pending = stream.pending, []
+        started = time.monotonic()
+        try:
+            await stream.message.edit(embed=stream.render(turns[-self.max_merged_turns :]))
+        except discord.RateLimited as e:
+            self.stats.incr("rate_limits")
+            stream.pending[:0] = turns
+            stream.interval = min(self.max_interval, max(stream.interval * 2, e.retry_after))
+        except discord.NotFound:
+            # the message was deleted, nobody is left to see the next turns
+            stream.close()
+        except discord.HTTPException as e:
+            if e.status == 429:
+                self.stats.incr("rate_limits")
+                stream.pending[:0] = turns
+                retry_after = float(e.response.headers.get("Retry-After", 0))
+                stream.interval = min(
+                    self.max_interval, max(stream.interval * 2, retry_after)
+                )
+            else:
+                self.stats.incr("message_edit_errors")
+                log.warning("Failed to edit a battle message", exc_info=True)
+        else:
+            latency = time.monotonic() - started
+            self.stats.incr("message_edits")
+            self.stats.observe("message_edit_seconds", latency)
+            # discord.py waits out bucket limits inside edit(), so a slow edit
+            # means this channel is being throttled
+            if latency > self.slow_edit:
+                stream.interval = min(self.max_interval, stream.interval * 1.5)
+            else:
+                stream.interval = max(self.min_interval, stream.interval * 0.8)
+        finally:
+            stream.in_flight = False
+            stream.next_at = time.monotonic() + stream.interval
+            if stream.pending and not stream.closed:
+                self._schedule(stream)
+            else:
+                stream.idle.set()
+
+
+class RenderBroadcast:
+    """
+    One live battle shown on several messages, such as the battle channel and
+    the channels spectating it.
+
+    Turns are pushed once and queued on the RenderStream of every message, so
+    each message keeps its own pace and rate limits. Every edit shows the
+    latest turns, so the embed of a turn is built once and shared by all the
+    messages edited before the next turn.
+    """
+
+    def __init__(
+        self, scheduler: RenderScheduler, render: Callable[[List[str]], discord.Embed]
+    ):
+        self.scheduler = scheduler
+        self.render = render
+        self.streams: List[RenderStream] = []
+        self.recent: deque = deque(maxlen=scheduler.max_merged_turns)
+        self.turns = 0
+        self._frame_turn: Optional[int] = None
+        self._frame: Optional[discord.Embed] = None
+
+    def add(self, message: discord.Message) -> RenderStream:
+        """Mirrors the battle on another message, from the next turn on."""
+        stream = self.scheduler.open(message, self.frame)
+        self.streams.append(stream)
+        return stream
+
+    def frame(self, turns: Optional[List[str]] = None) -> discord.Embed:
+        """The embed of the latest turns, the turns merged by a stream are among them."""
+        if self._frame_turn != self.turns:
+            self._frame = self.render(list(self.recent))
+            self._frame_turn = self.turns
+            self.scheduler.stats.incr("frames_rendered")
+        return self._frame
+
+    def push(self, text: str):
+        self.turns += 1
+        self.recent.append(text)
+        for stream in self.streams:
+            stream.push(text)
+
+    async def flush(self):
+        await asyncio.gather(*(stream.flush() for stream in self.streams))
+
+    def close(self):
+        for stream in self.streams:
+            stream.close()
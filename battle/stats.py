@@ -0,0 +1,115 @@
+import bisect
+import sys
+from typing import Dict, List, Sequence
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TURN_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01)
+
+
+class Histogram:
+    """A fixed bucket histogram, cumulative counts are only computed on export."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Returns the upper bound of the bucket holding the q-th quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class BattleStats:
+    """Counters and histograms of the battle hot paths."""
+
+    def __init__(self):
+        self.counters: Dict[str, int] = {
+            "battles_started": 0,
+            "battles_finished": 0,
+            "battles_cancelled": 0,
+            "battles_expired": 0,
+            "turns_simulated": 0,
+            "message_edits": 0,
+            "frames_rendered": 0,  # live battle embeds built, shared by their messages
+            "message_edit_errors": 0,
+            "rate_limits": 0,
+        }
+        self.histograms: Dict[str, Histogram] = {
+            "simulation_seconds_per_turn": Histogram(TURN_BUCKETS),
+            "message_edit_seconds": Histogram(LATENCY_BUCKETS),
+            "turn_sleep_drift_seconds": Histogram(LATENCY_BUCKETS),
+        }
+
+    def incr(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def observe(self, name: str, value: float):
+        self.histograms[name].observe(value)
+
+    def to_prometheus(self, gauges: Dict[str, float], prefix: str = "ballsdex_battle") -> str:
+        """Dumps every metric in the Prometheus text exposition format."""
+        lines: List[str] = []
+        for name, value in self.counters.items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        for name, value in gauges.items():
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+        for name, histogram in self.histograms.items():
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{prefix}_{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_{name}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{prefix}_{name}_sum {histogram.sum}")
+            lines.append(f"{prefix}_{name}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def deep_sizeof(obj, seen=None) -> int:
+    """
+    Roughly estimates the memory held by an object and what it references.
+    Only containers and dataclasses are followed, Discord
+    models are counted shallowly as they are shared with the bot's cache.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(
+            deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items()
+        )
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(deep_sizeof(item, seen) for item in obj)
+    if hasattr(obj, "__dataclass_fields__"):
+        return size + sum(
+            deep_sizeof(getattr(obj, name, None), seen) for name in obj.__dataclass_fields__
+        )
+    return size
@@ -0,0 +1,232 @@
+import asyncio
+import random
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ballsdex.packages.battle.xe_battle_lib import BattleBall, BattleInstance, gen_events
+
+ROUND_ROBIN = "round_robin"
+ELIMINATION = "elimination"
+MATCH_CHUNK = 16  # matches sent to a worker at once, tiny battles cost less than the pickling
+REPLAYS = 3  # elimination matches without a winner are replayed this many times
+
+
+@dataclass
+class Entrant:
+    user_id: int
+    name: str
+    deck: list  # deck_stats of the registered balls
+    wins: int = 0
+    losses: int = 0
+    draws: int = 0
+    turns: int = 0
+    eliminated: bool = False
+
+    @property
+    def points(self) -> int:
+        return 2 * self.wins + self.draws
+
+
+@dataclass
+class Match:
+    round: int
+    p1: Entrant
+    p2: Optional[Entrant]  # None for a bye
+    seed: int
+    winner: Optional[Entrant] = None
+    turns: int = 0
+    done: bool = False
+
+    @property
+    def loser(self) -> Optional[Entrant]:
+        if self.winner is None:
+            return None
+        return self.p2 if self.winner is self.p1 else self.p1
+
+
+def play_match(p1_stats, p2_stats, seed, replays=0) -> Tuple[int, int, int]:
+    """
+    Runs a battle on deck_stats data and returns the winning side (1, 2 or 0
+    if nobody won), the turn count and the seed of the battle that counted.
+    Battles without a winner are replayed `replays` times with the next seeds.
+    """
+    for attempt in range(replays + 1):
+        battle = BattleInstance(
+            [BattleBall(*stats) for stats in p1_stats],
+            [BattleBall(*stats) for stats in p2_stats],
+            seed=seed + attempt,
+        )
+        for _ in gen_events(battle):
+            pass
+        if all(ball.dead for ball in battle.p2_balls):
+            return 1, battle.turns, seed + attempt
+        if all(ball.dead for ball in battle.p1_balls):
+            return 2, battle.turns, seed + attempt
+    return 0, battle.turns, seed + attempt
+
+
+def play_matches(matches) -> List[Tuple[int, int, int]]:
+    """Runs play_match on every (p1_stats, p2_stats, seed, replays), meant for a worker process."""
+    return [play_match(*match) for match in matches]
+
+
+class Tournament:
+    """
+    A round robin or single elimination tournament between registered decks.
+
+    Every battle follows the gen_battle rules and is resolved at once, matches
+    are sent in chunks to an executor so big events use every worker. Results
+    are applied as they come back, `on_result` is called after each one to
+    let the caller refresh the standings or the bracket.
+    """
+
+    def __init__(self, name: str, format: str, deck_size: int, seed: Optional[int] = None):
+        self.name = name
+        self.format = format
+        self.deck_size = deck_size
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.rng = random.Random(self.seed)
+        self.entrants: Dict[int, Entrant] = {}
+        self.rounds: List[List[Match]] = []
+        self.running = False
+        self.finished = False
+
+    def register(self, user_id: int, name: str, deck: list):
+        """Registers a deck, replacing the previous one of this user."""
+        self.entrants[user_id] = Entrant(user_id, name, deck)
+
+    def unregister(self, user_id: int) -> bool:
+        return self.entrants.pop(user_id, None) is not None
+
+    @property
+    def total_matches(self) -> int:
+        count = len(self.entrants)
+        if self.format == ROUND_ROBIN:
+            return count * (count - 1) // 2
+        return max(count - 1, 0)
+
+    @property
+    def played_matches(self) -> int:
+        return sum(
+            match.done and match.p2 is not None for matches in self.rounds for match in matches
+        )
+
+    @property
+    def champion(self) -> Optional[Entrant]:
+        if not self.finished or not self.entrants:
+            return None
+        if self.format == ROUND_ROBIN:
+            return self.standings()[0]
+        return self.rounds[-1][0].winner if self.rounds else next(iter(self.entrants.values()))
+
+    def standings(self) -> List[Entrant]:
+        """Entrants by points, then by fewest turns played."""
+        return sorted(
+            self.entrants.values(), key=lambda entrant: (-entrant.points, entrant.turns)
+        )
+
+    def _match(self, round: int, p1: Entrant, p2: Optional[Entrant]) -> Match:
+        return Match(round, p1, p2, self.rng.getrandbits(32))
+
+    def _first_round(self) -> List[Match]:
+        entrants = list(self.entrants.values())
+        if self.format == ROUND_ROBIN:
+            return [
+                self._match(0, p1, p2)
+                for i, p1 in enumerate(entrants)
+                for p2 in entrants[i + 1 :]
+            ]
+        # entrants are seeded in registration order, the first ones get the byes
+        size = 1
+        while size < len(entrants):
+            size *= 2
+        byes = size - len(entrants)
+        matches = [self._match(0, entrant, None) for entrant in entrants[:byes]]
+        rest = entrants[byes:]
+        matches += [self._match(0, rest[i], rest[-i - 1]) for i in range(len(rest) // 2)]
+        return matches
+
+    def _next_round(self) -> List[Match]:
+        winners = [match.winner for match in self.rounds[-1]]
+        return [
+            self._match(len(self.rounds), winners[i], winners[i + 1])
+            for i in range(0, len(winners), 2)
+        ]
+
+    def _apply(self, match: Match, side: int, turns: int, seed: int):
+        match.done = True
+        match.turns = turns
+        match.seed = seed
+        if match.p2 is None:
+            match.winner = match.p1
+            return
+        match.p1.turns += turns
+        match.p2.turns += turns
+        if side == 0 and self.format == ELIMINATION:
+            # still no winner after the replays, the better seed goes through
+            side = 1
+        if side == 0:
+            match.p1.draws += 1
+            match.p2.draws += 1
+            return
+        match.winner = match.p1 if side == 1 else match.p2
+        match.winner.wins += 1
+        match.loser.losses += 1
+        if self.format == ELIMINATION:
+            match.loser.eliminated = True
+
+    async def _play_round(
+        self,
+        matches: List[Match],
+        executor: Optional[Executor],
+        on_result: Callable[[Match], None],
+    ):
+        loop = asyncio.get_running_loop()
+        replays = REPLAYS if self.format == ELIMINATION else 0
+        for match in matches:
+            if match.p2 is None:
+                self._apply(match, 1, 0, match.seed)
+                on_result(match)
+
+        played = [match for match in matches if match.p2 is not None]
+        chunks = [played[i : i + MATCH_CHUNK] for i in range(0, len(played), MATCH_CHUNK)]
+
+        async def play(chunk):
+            return chunk, await loop.run_in_executor(
+                executor,
+                play_matches,
+                [(match.p1.deck, match.p2.deck, match.seed, replays) for match in chunk],
+            )
+
+        tasks = [asyncio.ensure_future(play(chunk)) for chunk in chunks]
+        try:
+            for next_chunk in asyncio.as_completed(tasks):
+                chunk, results = await next_chunk
+                for match, result in zip(chunk, results):
+                    self._apply(match, *result)
+                    on_result(match)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def run(
+        self,
+        executor: Optional[Executor] = None,
+        on_result: Callable[[Match], None] = lambda match: None,
+    ):
+        """
+        Plays every match. `executor` is a process pool to spread the battles
+        on, the default thread pool of the loop is used if None.
+        """
+        self.running = True
+        try:
+            if len(self.entrants) > 1:
+                self.rounds.append(self._first_round())
+                await self._play_round(self.rounds[-1], executor, on_result)
+                while self.format == ELIMINATION and len(self.rounds[-1]) > 1:
+                    self.rounds.append(self._next_round())
+                    await self._play_round(self.rounds[-1], executor, on_result)
+            self.finished = True
+        finally:
+            self.running = False
@@ -1,5 +1,13 @@
 from dataclasses import dataclass, field
+from typing import Dict, NamedTuple, Optional, Tuple
 import random
+import string
+import struct
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the batch simulator
+    np = None
 
 
 ATTACK_MESSAGES = [
@@ -22,12 +30,84 @@ DODGE_MESSAGES = [
     "{d_name} presses the mute button!!",
 ]
 
+DODGE_CHANCE = 0.30
+CRIT_CHANCE = 0.25
+CRIT_MULTIPLIER = 1.5
+
+CRIT_SUFFIX = " 💥 **CRITICAL HIT!**"
+# fields the messages can use, in the order MessagePack passes them
+MESSAGE_FIELDS = ("a_owner", "a_name", "d_owner", "d_name", "dmg")
+
+MAX_TURNS = 10_000  # battles still going after this many turns end without a winner
+
+# turn, attacker index, target index, damage, flags, message roll
+# the roll is a random byte, the message is picked from whatever pool is used to show it
+EVENT_FORMAT = struct.Struct("<IHHIBB")
+
+FLAG_P2 = 1  # the attacker belongs to p2
+FLAG_CRIT = 2
+FLAG_DODGE = 4
+FLAG_DEFEAT = 8
+
+
+def format_random(msg_list, rng=random, **kwargs):
+    return rng.choice(msg_list).format(**kwargs)
+
+
+def compile_message(message: str) -> str:
+    """
+    Turns a message using the named MESSAGE_FIELDS into a positional format
+    string, so that rendering it needs no keyword dict. Raises ValueError
+    if the message is malformed or uses an unknown field.
+    """
+    compiled = []
+    for literal, name, spec, conversion in string.Formatter().parse(message):
+        compiled.append(literal.replace("{", "{{").replace("}", "}}"))
+        if name is None:
+            continue
+        if name not in MESSAGE_FIELDS:
+            raise ValueError(f"Unknown field {{{name}}} in message {message!r}")
+        compiled.append(
+            "{"
+            + str(MESSAGE_FIELDS.index(name))
+            + (f"!{conversion}" if conversion else "")
+            + (f":{spec}" if spec else "")
+            + "}"
+        )
+    return "".join(compiled)
+
+
+class MessagePack:
+    """The attack, defeat and dodge messages of a battle, compiled once."""
+
+    __slots__ = ("attack", "defeat", "dodge")
+
+    def __init__(self, attack, defeat, dodge):
+        if not (attack and defeat and dodge):
+            raise ValueError("Every message pool needs at least one message")
+        self.attack = tuple(map(compile_message, attack))
+        self.defeat = tuple(map(compile_message, defeat))
+        self.dodge = tuple(map(compile_message, dodge))
+
+    def format(self, event: "BattleEvent", a_owner, a_name, d_owner, d_name) -> str:
+        if event.dodge:
+            pool = self.dodge
+        elif event.defeat:
+            pool = self.defeat
+        else:
+            pool = self.attack
+        text = pool[event.message % len(pool)].format(
+            a_owner, a_name, d_owner, d_name, event.damage
+        )
+        if event.crit:
+            return f"Turn {event.turn}: {text}{CRIT_SUFFIX}"
+        return f"Turn {event.turn}: {text}"
 
-def format_random(msg_list, **kwargs):
-    return random.choice(msg_list).format(**kwargs)
 
+DEFAULT_PACK = MessagePack(ATTACK_MESSAGES, DEFEAT_MESSAGES, DODGE_MESSAGES)
 
-@dataclass
+
+@dataclass(slots=True)
 class BattleBall:
     name: str
     owner: str
@@ -44,55 +124,94 @@ class BattleInstance:
     winner: str = ""
     turns: int = 0
     deck_size: int = 4
-
-
-def get_damage(ball):
-    base = ball.attack * random.uniform(0.5, 1)
-    is_super = random.random() < 0.25
+    seed: Optional[int] = None
+    rng: Optional[random.Random] = field(default=None, repr=False, compare=False)
+    log: bytearray = field(default_factory=bytearray, repr=False)
+    # balls proposed while planning the battle, keyed by ball instance ID
+    p1_deck: Dict[int, BattleBall] = field(default_factory=dict, repr=False)
+    p2_deck: Dict[int, BattleBall] = field(default_factory=dict, repr=False)
+
+    def lock_decks(self):
+        """Turns the planned decks into the fighting balls, in the order they were added."""
+        self.p1_balls = list(self.p1_deck.values())
+        self.p2_balls = list(self.p2_deck.values())
+
+
+class BattleEvent(NamedTuple):
+    turn: int
+    attacker: int
+    target: int
+    damage: int
+    flags: int
+    message: int
+
+    @property
+    def side(self):
+        return 2 if self.flags & FLAG_P2 else 1
+
+    @property
+    def crit(self):
+        return bool(self.flags & FLAG_CRIT)
+
+    @property
+    def dodge(self):
+        return bool(self.flags & FLAG_DODGE)
+
+    @property
+    def defeat(self):
+        return bool(self.flags & FLAG_DEFEAT)
+
+
+def get_damage(ball, rng=random):
+    base = ball.attack * rng.uniform(0.5, 1)
+    is_super = rng.random() < CRIT_CHANCE
     if is_super:
-        return int(base * 1.5), True
+        return int(base * CRIT_MULTIPLIER), True
     return int(base), False
 
 
-def attack(current_ball, enemy_balls):
-    alive_balls = [ball for ball in enemy_balls if not ball.dead]
-    enemy = random.choice(alive_balls)
-
-    damage, is_super = get_damage(current_ball)
+def apply_damage(current_ball, enemy, rng=random):
+    """Rolls the damage of current_ball against enemy, applies it and returns (damage, is_super)."""
+    damage, is_super = get_damage(current_ball, rng)
     enemy.health -= damage
     if enemy.health <= 0:
         enemy.health = 0
         enemy.dead = True
+    return damage, is_super
 
-    if enemy.dead:
-        text = format_random(
-            DEFEAT_MESSAGES,
-            a_owner=current_ball.owner,
-            a_name=current_ball.name,
-            d_owner=enemy.owner,
-            d_name=enemy.name,
-            dmg=damage,
-        )
-    else:
-        text = format_random(
-            ATTACK_MESSAGES,
-            a_owner=current_ball.owner,
-            a_name=current_ball.name,
-            d_owner=enemy.owner,
-            d_name=enemy.name,
-            dmg=damage,
-        )
+
+def resolve_attack(current_ball, enemy_balls, rng=random):
+    """Picks a random alive target, applies the damage and returns (enemy, damage, is_super)."""
+    alive_balls = [ball for ball in enemy_balls if not ball.dead]
+    enemy = rng.choice(alive_balls)
+    damage, is_super = apply_damage(current_ball, enemy, rng)
+    return enemy, damage, is_super
+
+
+def attack(current_ball, enemy_balls, rng=random):
+    enemy, damage, is_super = resolve_attack(current_ball, enemy_balls, rng)
+
+    text = format_random(
+        DEFEAT_MESSAGES if enemy.dead else ATTACK_MESSAGES,
+        rng,
+        a_owner=current_ball.owner,
+        a_name=current_ball.name,
+        d_owner=enemy.owner,
+        d_name=enemy.name,
+        dmg=damage,
+    )
 
     if is_super:
-        text += " 💥 **CRITICAL HIT!**"
+        text += CRIT_SUFFIX
 
     return text
 
 
-def random_events(p1_ball, p2_ball):
-    if random.randint(1, 100) <= 30:
+def random_events(p1_ball, p2_ball, rng=random):
+    if rng.random() < DODGE_CHANCE:
         msg = format_random(
             DODGE_MESSAGES,
+            rng,
             a_owner=p2_ball.owner,
             a_name=p2_ball.name,
             d_owner=p1_ball.owner,
@@ -102,47 +221,446 @@ def random_events(p1_ball, p2_ball):
     return False, ""
 
 
-def gen_battle(battle: BattleInstance):
+class BattleText:
+    """
+    Builds the text of turns of one battle, only when asked for.
+    The names of the balls are bound once, as they never change during a battle.
+    """
+
+    __slots__ = ("pack", "p1", "p2")
+
+    def __init__(self, battle: BattleInstance, pack: Optional[MessagePack] = None):
+        self.pack = pack or DEFAULT_PACK
+        self.p1 = [(ball.owner, ball.name) for ball in battle.p1_balls]
+        self.p2 = [(ball.owner, ball.name) for ball in battle.p2_balls]
+
+    def format(self, event: BattleEvent) -> str:
+        own, other = (self.p1, self.p2) if event.side == 1 else (self.p2, self.p1)
+        ball, enemy = own[event.attacker], other[event.target]
+        if event.dodge:
+            ball, enemy = enemy, ball
+        return self.pack.format(event, *ball, *enemy)
+
+
+def iter_events(log):
+    """Decodes a binary battle log into BattleEvents."""
+    for values in EVENT_FORMAT.iter_unpack(log):
+        yield BattleEvent(*values)
+
+
+def replay(battle: BattleInstance, pack: Optional[MessagePack] = None):
+    """Yields the turn texts of a finished battle from its log, without re-simulating."""
+    text = BattleText(battle, pack)
+    for event in iter_events(battle.log):
+        yield text.format(event)
+
+
+def pick_seed(battle: BattleInstance) -> int:
+    """Returns the seed of the battle, picking one if it has none yet."""
+    if battle.seed is None:
+        battle.seed = random.getrandbits(63)
+    return battle.seed
+
+
+def _battle_rng(battle: BattleInstance, rng):
+    if rng is not None:
+        return rng
+    if battle.rng is not None:
+        return battle.rng
+    return random.Random(pick_seed(battle))
+
+
+class AliveSet:
+    """
+    Indexes of the alive balls of a deck.
+    A swap-remove array gives O(1) removal and random picks, and a linked list
+    keeps the deck order used to pair balls at the start of every round.
+    """
+
+    __slots__ = ("members", "positions", "next", "prev", "head")
+
+    def __init__(self, balls):
+        self.members = [i for i, ball in enumerate(balls) if not ball.dead]
+        self.positions = [-1] * len(balls)
+        self.next = [-1] * len(balls)
+        self.prev = [-1] * len(balls)
+        for position, index in enumerate(self.members):
+            self.positions[index] = position
+        for before, after in zip(self.members, self.members[1:]):
+            self.next[before] = after
+            self.prev[after] = before
+        self.head = self.members[0] if self.members else -1
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, index):
+        return self.positions[index] != -1
+
+    def remove(self, index):
+        position = self.positions[index]
+        last = self.members.pop()
+        if last != index:
+            self.members[position] = last
+            self.positions[last] = position
+        self.positions[index] = -1
+
+        before, after = self.prev[index], self.next[index]
+        if before == -1:
+            self.head = after
+        else:
+            self.next[before] = after
+        if after != -1:
+            self.prev[after] = before
+
+    def choice(self, rng=random):
+        return rng.choice(self.members)
+
+    def first(self, count):
+        """Returns the first `count` alive indexes, in deck order."""
+        indexes = []
+        index = self.head
+        while index != -1 and len(indexes) < count:
+            indexes.append(index)
+            index = self.next[index]
+        return indexes
+
+
+def _take_turn(battle, turn, attacker, partner, own_balls, enemy_balls, enemy_alive, flags, rng):
+    ball = own_balls[attacker]
+    if rng.random() < DODGE_CHANCE:
+        target, damage = partner, 0
+        flags |= FLAG_DODGE
+        message = rng.getrandbits(8)
+    else:
+        target = enemy_alive.choice(rng)
+        enemy = enemy_balls[target]
+        damage, is_super = apply_damage(ball, enemy, rng)
+        if is_super:
+            flags |= FLAG_CRIT
+        if enemy.dead:
+            flags |= FLAG_DEFEAT
+            enemy_alive.remove(target)
+        message = rng.getrandbits(8)
+
+    event = BattleEvent(turn, attacker, target, damage, flags, message)
+    battle.log += EVENT_FORMAT.pack(*event)
+    return event
+
+
+def gen_events(
+    battle: BattleInstance, rng: Optional[random.Random] = None, max_turns: int = MAX_TURNS
+):
+    """
+    Runs the battle turn by turn, yielding the BattleEvent of every turn.
+    Every random draw comes from `rng`, `battle.rng` or a Random seeded with
+    `battle.seed` (one is picked if unset), and each turn is appended to `battle.log`.
+    The battle ends without a winner after `max_turns` turns.
+    """
+    rng = _battle_rng(battle, rng)
+    battle.log = bytearray()
+    p1_balls, p2_balls = battle.p1_balls, battle.p2_balls
+    alive_p1, alive_p2 = AliveSet(p1_balls), AliveSet(p2_balls)
     turn = 0
 
-    while any(ball for ball in battle.p1_balls if not ball.dead) and any(
-        ball for ball in battle.p2_balls if not ball.dead
-    ):
-        alive_p1 = [ball for ball in battle.p1_balls if not ball.dead]
-        alive_p2 = [ball for ball in battle.p2_balls if not ball.dead]
+    while alive_p1 and alive_p2 and turn < max_turns:
+        pairs = min(len(alive_p1), len(alive_p2))
 
-        for p1_ball, p2_ball in zip(alive_p1, alive_p2):
-            if not p1_ball.dead:
+        for p1_index, p2_index in zip(alive_p1.first(pairs), alive_p2.first(pairs)):
+            if turn >= max_turns:
+                break
+            if p1_index in alive_p1:
                 turn += 1
 
-                event = random_events(p1_ball, p2_ball)
-                if event[0]:
-                    yield f"Turn {turn}: {event[1]}"
+                event = _take_turn(
+                    battle, turn, p1_index, p2_index, p1_balls, p2_balls, alive_p2, 0, rng
+                )
+                yield event
+                if event.dodge:
                     continue
 
-                yield f"Turn {turn}: {attack(p1_ball, battle.p2_balls)}"
-
-                if all(ball.dead for ball in battle.p2_balls):
+                if not alive_p2:
                     break
 
-            if not p2_ball.dead:
+            if p2_index in alive_p2 and turn < max_turns:
                 turn += 1
 
-                event = random_events(p2_ball, p1_ball)
-                if event[0]:
-                    yield f"Turn {turn}: {event[1]}"
+                event = _take_turn(
+                    battle, turn, p2_index, p1_index, p2_balls, p1_balls, alive_p1, FLAG_P2, rng
+                )
+                yield event
+                if event.dodge:
                     continue
 
-                yield f"Turn {turn}: {attack(p2_ball, battle.p1_balls)}"
-
-                if all(ball.dead for ball in battle.p1_balls):
+                if not alive_p1:
                     break
 
+    if not alive_p1:
+        battle.winner = p2_balls[0].owner
+    elif not alive_p2:
+        battle.winner = p1_balls[0].owner
+
+    battle.turns = turn
+
+
+def gen_battle(
+    battle: BattleInstance,
+    rng: Optional[random.Random] = None,
+    pack: Optional[MessagePack] = None,
+    max_turns: int = MAX_TURNS,
+):
+    """Runs the battle turn by turn, yielding the text of every turn."""
+    text = BattleText(battle, pack)
+    for event in gen_events(battle, rng, max_turns):
+        yield text.format(event)
+
+
+def deck_stats(balls):
+    """Returns the plain data needed to simulate a deck in another process."""
+    return [(ball.name, ball.owner, ball.health, ball.attack) for ball in balls]
+
+
+def simulate_log(p1_stats, p2_stats, seed, max_turns=MAX_TURNS) -> bytes:
+    """
+    Runs a whole battle on plain deck data and returns its binary log.
+    Meant to be run in a worker process, see play_log to apply it.
+    """
+    battle = BattleInstance(
+        [BattleBall(*stats) for stats in p1_stats],
+        [BattleBall(*stats) for stats in p2_stats],
+        seed=seed,
+    )
+    for _ in gen_events(battle, max_turns=max_turns):
+        pass
+    return bytes(battle.log)
+
+
+def apply_event(battle: BattleInstance, event: BattleEvent):
+    """Applies the damage of a logged turn to the balls of the battle."""
+    if event.dodge:
+        return
+    enemy_balls = battle.p2_balls if event.side == 1 else battle.p1_balls
+    enemy = enemy_balls[event.target]
+    enemy.health = max(enemy.health - event.damage, 0)
+    if event.defeat:
+        enemy.dead = True
+
+
+def play_log(battle: BattleInstance, log):
+    """
+    Applies a log made by simulate_log to the balls of the battle turn by turn,
+    yielding every event once applied. The winner and turns are set at the end.
+    """
+    battle.log = bytearray(log)
+    for event in iter_events(log):
+        apply_event(battle, event)
+        battle.turns = event.turn
+        yield event
+
     if all(ball.dead for ball in battle.p1_balls):
         battle.winner = battle.p2_balls[0].owner
     elif all(ball.dead for ball in battle.p2_balls):
         battle.winner = battle.p1_balls[0].owner
 
-    battle.turns = turn
-
-
+@dataclass
+class BatchResult:
+    battles: int
+    p1_wins: int
+    p2_wins: int
+    unfinished: int
+    turn_histogram: list
+    avg_p1_health: float
+    avg_p2_health: float
+
+    @property
+    def p1_win_rate(self):
+        return self.p1_wins / self.battles if self.battles else 0.0
+
+    @property
+    def p2_win_rate(self):
+        return self.p2_wins / self.battles if self.battles else 0.0
+
+    @property
+    def avg_turns(self):
+        total = sum(turns * count for turns, count in enumerate(self.turn_histogram))
+        return total / self.battles if self.battles else 0.0
+
+
+def _deck_arrays(decks, size):
+    health = np.zeros((len(decks), size), dtype=np.int64)
+    attack = np.zeros((len(decks), size), dtype=np.int64)
+    for row, deck in enumerate(decks):
+        health[row, : len(deck)] = [ball.health for ball in deck]
+        attack[row, : len(deck)] = [ball.attack for ball in deck]
+    return health, attack
+
+
+def _round_order(alive):
+    # alive balls first, in deck order, like the list comprehensions in gen_battle
+    return np.argsort(~alive, axis=1, kind="stable")
+
+
+def _pick_targets(alive, draws):
+    counts = alive.sum(axis=1)
+    wanted = (draws * counts).astype(np.int64)
+    return (alive.cumsum(axis=1) > wanted[:, None]).argmax(axis=1)
+
+
+def _simulate_arrays(h1, a1, h2, a2, rng, max_turns, block_size):
+    """
+    Runs one half-turn of gen_battle per step for every battle at once.
+    The state machine mirrors gen_battle exactly, including a dodge on the
+    first ball of a pair skipping its partner's move.
+    """
+    n, size = h1.shape
+    rows = np.arange(n)
+    health = np.stack([h1, h2]).astype(np.int64)
+    attack = np.stack([a1, a2]).astype(np.int64)
+    alive = health > 0
+
+    order = np.stack([_round_order(alive[0]), _round_order(alive[1])])
+    pair_count = np.minimum(alive[0].sum(axis=1), alive[1].sum(axis=1))
+    pair = np.zeros(n, dtype=np.int64)
+    side = np.zeros(n, dtype=np.int64)
+    turns = np.zeros(n, dtype=np.int64)
+    active = (pair_count > 0) & (turns < max_turns)
+
+    block = None
+    step = block_size
+    while active.any():
+        if step == block_size:
+            # dodge, target, damage roll and crit roll for block_size steps
+            block = rng.random((block_size, 4, n))
+            step = 0
+        dodge_roll, target_roll, damage_roll, crit_roll = block[step]
+        step += 1
+
+        idx = rows[active]
+        s = side[idx]
+        enemy = 1 - s
+        attacker = order[s, idx, pair[idx]]
+        moves = alive[s, idx, attacker]
+
+        turns[idx] += moves
+        dodged = moves & (dodge_roll[idx] < DODGE_CHANCE)
+        hits = moves & ~dodged
+
+        hit_idx = idx[hits]
+        if hit_idx.size:
+            hit_enemy = enemy[hits]
+            targets = _pick_targets(alive[hit_enemy, hit_idx], target_roll[hit_idx])
+            base = attack[s[hits], hit_idx, attacker[hits]] * (
+                0.5 + 0.5 * damage_roll[hit_idx]
+            )
+            crit = crit_roll[hit_idx] < CRIT_CHANCE
+            damage = np.where(crit, base * CRIT_MULTIPLIER, base).astype(np.int64)
+            remaining = health[hit_enemy, hit_idx, targets] - damage
+            health[hit_enemy, hit_idx, targets] = np.maximum(remaining, 0)
+            alive[hit_enemy, hit_idx, targets] = remaining > 0
+
+        # a dodge ends the pair, the second half of a pair always does
+        next_pair = dodged | (s == 1)
+        pair[idx] += next_pair
+        side[idx] = np.where(next_pair, 0, 1)
+
+        finished = ~alive[0, idx].any(axis=1) | ~alive[1, idx].any(axis=1)
+        new_round = idx[~finished & (pair[idx] >= pair_count[idx])]
+        if new_round.size:
+            order[0, new_round] = _round_order(alive[0, new_round])
+            order[1, new_round] = _round_order(alive[1, new_round])
+            pair_count[new_round] = np.minimum(
+                alive[0, new_round].sum(axis=1), alive[1, new_round].sum(axis=1)
+            )
+            pair[new_round] = 0
+            side[new_round] = 0
+        active[idx] = ~finished & (turns[idx] < max_turns)
+
+    p1_lost = ~alive[0].any(axis=1)
+    p2_lost = ~alive[1].any(axis=1)
+    return p2_lost & ~p1_lost, p1_lost, turns, health[0].sum(axis=1), health[1].sum(axis=1)
+
+
+def _batch_result(p1_won, p2_won, turns, p1_health, p2_health):
+    return BatchResult(
+        battles=len(turns),
+        p1_wins=int(p1_won.sum()),
+        p2_wins=int(p2_won.sum()),
+        unfinished=int((~p1_won & ~p2_won).sum()),
+        turn_histogram=np.bincount(turns).tolist(),
+        avg_p1_health=float(p1_health.mean()) if len(turns) else 0.0,
+        avg_p2_health=float(p2_health.mean()) if len(turns) else 0.0,
+    )
+
+
+def simulate_many(pairs, battles=1000, seed=None, max_turns=MAX_TURNS, block_size=64):
+    """
+    Simulates `battles` battles for every (p1_balls, p2_balls) pair in one
+    vectorized run and returns a BatchResult per pair.
+    Uses the same rules as gen_battle, but never touches the given balls.
+    """
+    if np is None:
+        raise RuntimeError("The batch simulator requires numpy to be installed.")
+    pairs = list(pairs)
+    if not pairs:
+        return []
+
+    size = max(max(len(p1), len(p2)) for p1, p2 in pairs)
+    h1, a1 = _deck_arrays([p1 for p1, _ in pairs], size)
+    h2, a2 = _deck_arrays([p2 for _, p2 in pairs], size)
+    outcome = _simulate_arrays(
+        np.repeat(h1, battles, axis=0),
+        np.repeat(a1, battles, axis=0),
+        np.repeat(h2, battles, axis=0),
+        np.repeat(a2, battles, axis=0),
+        np.random.default_rng(seed),
+        max_turns,
+        block_size,
+    )
+
+    results = []
+    for i in range(len(pairs)):
+        part = slice(i * battles, (i + 1) * battles)
+        results.append(_batch_result(*(values[part] for values in outcome)))
+    return results
+
+
+def simulate(p1_balls, p2_balls, battles=1000, seed=None, max_turns=MAX_TURNS):
+    """Simulates `battles` battles between two decks and returns a BatchResult."""
+    return simulate_many([(p1_balls, p2_balls)], battles, seed, max_turns)[0]
+
+
+ODDS_BATTLES = 2_000
+
+
+def estimate_odds(p1_stats, p2_stats, battles=ODDS_BATTLES, seed=0) -> Tuple[float, float]:
+    """
+    Estimates the probabilities of p1 and p2 winning over `battles` simulated
+    battles, with a fixed seed so the same decks always get the same answer.
+    Takes deck_stats data, meant to be run in a worker process.
+    """
+    if not p1_stats or not p2_stats:
+        return float(bool(p1_stats)), float(bool(p2_stats))
+
+    if np is not None:
+        result = simulate(
+            [BattleBall(*stats) for stats in p1_stats],
+            [BattleBall(*stats) for stats in p2_stats],
+            battles,
+            seed,
+        )
+        return result.p1_win_rate, result.p2_win_rate
+
+    rng = random.Random(seed)
+    p1_wins = p2_wins = 0
+    for _ in range(battles):
+        battle = BattleInstance(
+            [BattleBall(*stats) for stats in p1_stats],
+            [BattleBall(*stats) for stats in p2_stats],
+        )
+        for _ in gen_events(battle, rng):
+            pass
+        if all(ball.dead for ball in battle.p2_balls):
+            p1_wins += 1
+        elif all(ball.dead for ball in battle.p1_balls):
+            p2_wins += 1
+    return p1_wins / battles, p2_wins / battles
@@ -0,0 +1,271 @@
+"""
+Benchmark suite for xe_battle_lib and the battle render path.
+
+    python benchmarks/bench_battle.py                      # run and print
+    python benchmarks/bench_battle.py --save               # also write the baseline
+    python benchmarks/bench_battle.py --compare            # compare with the baseline
+
+The baseline is benchmarks/baseline.json unless --baseline is given. Comparing
+flags every metric that got worse by more than --tolerance (20% by default), so
+changes to the damage formula or to the messages show up as turn count, speed
+or allocation regressions.
+
+Run it from a BallsDex checkout or from this repository alone: when `ballsdex`
+is not importable, the battle folder is mounted as `ballsdex.packages.battle`.
+When `discord` is not installed, the rendering benchmarks use a stub Embed.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+import types
+from pathlib import Path
+
+BATTLE_DIR = Path(__file__).resolve().parent.parent / "battle"
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+DECK_SIZES = [1, 4, 10, 100, 1000]
+
+# metrics where a higher value is better, every other metric is better lower
+HIGHER_IS_BETTER = ("per_sec",)
+
+
+def _mount_package():
+    try:
+        import ballsdex.packages.battle  # noqa: F401
+        return
+    except ImportError:
+        pass
+    for name in ("ballsdex", "ballsdex.packages"):
+        module = sys.modules.setdefault(name, types.ModuleType(name))
+        module.__path__ = []
+    package = types.ModuleType("ballsdex.packages.battle")
+    package.__path__ = [str(BATTLE_DIR)]
+    sys.modules["ballsdex.packages.battle"] = package
+
+    try:
+        import discord  # noqa: F401
+    except ImportError:
+        sys.modules["discord"] = _stub_discord()
+
+
+def _stub_discord():
+    discord = types.ModuleType("discord")
+
+    class Embed:
+        def __init__(self, title=None, description=None, color=None, colour=None):
+            self.title = title
+            self.description = description
+            self.color = color or colour
+            self.fields = []
+            self.footer = None
+
+        def add_field(self, *, name, value, inline=True):
+            self.fields.append({"name": name, "value": value, "inline": inline})
+            return self
+
+        def set_field_at(self, index, *, name, value, inline=True):
+            self.fields[index] = {"name": name, "value": value, "inline": inline}
+            return self
+
+        def set_footer(self, *, text=None, icon_url=None):
+            self.footer = text
+            return self
+
+    class Colour:
+        @classmethod
+        def blurple(cls):
+            return 0x5865F2
+
+    class HTTPException(Exception):
+        status = 0
+
+    class RateLimited(Exception):
+        retry_after = 0.0
+
+    discord.Embed = Embed
+    discord.Colour = discord.Color = Colour
+    discord.Message = object
+    discord.HTTPException = HTTPException
+    discord.RateLimited = RateLimited
+    return discord
+
+
+_mount_package()
+
+from ballsdex.packages.battle import xe_battle_lib as lib  # noqa: E402
+from ballsdex.packages.battle.render import DeckRenderer, gen_deck, update_embed  # noqa: E402
+
+
+class StubEmoji:
+    def __str__(self):
+        return "<:ball:123456789012345678>"
+
+
+def make_deck(owner, size, rng):
+    return [
+        lib.BattleBall(
+            f"{owner}-ball-{i}",
+            owner,
+            rng.randint(300, 3000),
+            rng.randint(100, 1500),
+            StubEmoji(),
+        )
+        for i in range(size)
+    ]
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return time.perf_counter() - start
+
+
+def bench_primitives(calls):
+    rng = random.Random(0)
+    ball = make_deck("p1", 1, rng)[0]
+    results = {
+        "get_damage.calls_per_sec": calls / timed(lambda: lib.get_damage(ball, rng), calls),
+        "format_random.calls_per_sec": calls
+        / timed(
+            lambda: lib.format_random(
+                lib.ATTACK_MESSAGES,
+                rng,
+                a_owner="p1",
+                a_name="a",
+                d_owner="p2",
+                d_name="b",
+                dmg=100,
+            ),
+            calls,
+        ),
+    }
+
+    for size in DECK_SIZES:
+        enemies = make_deck("p2", size, rng)
+        for enemy in enemies:
+            enemy.health = 10**12  # nobody dies, every call does the same work
+        results[f"attack[{size}].calls_per_sec"] = calls / timed(
+            lambda: lib.attack(ball, enemies, rng), calls
+        )
+    return results
+
+
+def bench_battles(battles):
+    results = {}
+    for size in DECK_SIZES:
+        rng = random.Random(size)
+        decks = [(make_deck("p1", size, rng), make_deck("p2", size, rng)) for _ in range(battles)]
+        count = max(1, battles // size)
+
+        turns = 0
+        start = time.perf_counter()
+        for i, (p1, p2) in enumerate(decks[:count]):
+            battle = lib.BattleInstance(p1, p2, seed=i)
+            for _ in lib.gen_battle(battle):
+                pass
+            turns += battle.turns
+        elapsed = time.perf_counter() - start
+
+        # live allocations per turn, with the turn texts kept like a transcript would,
+        # on new decks as the timed battles may have used all of them
+        p1, p2 = make_deck("p1", size, rng), make_deck("p2", size, rng)
+        battle = lib.BattleInstance(p1, p2, seed=0)
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        texts = list(lib.gen_battle(battle))
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+        del texts
+
+        results[f"gen_battle[{size}].battles_per_sec"] = count / elapsed
+        results[f"gen_battle[{size}].turns_per_sec"] = turns / elapsed
+        results[f"gen_battle[{size}].avg_turns"] = turns / count
+        results[f"gen_battle[{size}].allocations_per_turn"] = blocks / max(battle.turns, 1)
+        results[f"gen_battle[{size}].peak_kib"] = peak / 1024
+    return results
+
+
+def bench_render(repeat):
+    results = {}
+    for size in DECK_SIZES:
+        rng = random.Random(size)
+        p1, p2 = make_deck("p1", size, rng), make_deck("p2", size, rng)
+        count = max(1, repeat // size)
+
+        results[f"gen_deck[{size}].calls_per_sec"] = count / timed(lambda: gen_deck(p1), count)
+        results[f"update_embed[{size}].calls_per_sec"] = count / timed(
+            lambda: update_embed(p1, p2, "p1", "p2", False, True, size), count
+        )
+
+        # one turn of a live battle: a ball is hit and the deck field is re-rendered
+        deck = DeckRenderer(p2)
+
+        def turn():
+            index = rng.randrange(size)
+            p2[index].health -= 1
+            deck.mark(index)
+            deck.render()
+
+        results[f"deck_turn[{size}].calls_per_sec"] = repeat / timed(turn, repeat)
+    return results
+
+
+def run(scale):
+    results = {}
+    results.update(bench_primitives(int(20_000 * scale)))
+    results.update(bench_battles(int(200 * scale)))
+    results.update(bench_render(int(2_000 * scale)))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    print(f"{'benchmark':<45} {'baseline':>14}    {'current':>14} (change, positive is worse)")
+    regressions = []
+    for name, value in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        change = (value - old) / old
+        if name.endswith(HIGHER_IS_BETTER):
+            change = -change
+        flag = ""
+        if change > tolerance:
+            flag = "  <-- regression"
+            regressions.append(name)
+        print(f"{name:<45} {old:>14,.2f} -> {value:>14,.2f} ({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="write the results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="compare with the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies every iteration count")
+    args = parser.parse_args()
+
+    results = run(args.scale)
+
+    if args.compare:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.tolerance:.0%}")
+            sys.exit(1)
+    else:
+        for name, value in results.items():
+            print(f"{name:<45} {value:>14,.2f}")
+
+    if args.save:
+        args.baseline.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+        print(f"\nBaseline saved to {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
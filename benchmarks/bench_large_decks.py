@@ -0,0 +1,43 @@
+"""
+Times gen_battle on very large decks.
+
+    python benchmarks/bench_large_decks.py [deck_size ...]
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "battle"))
+
+from xe_battle_lib import BattleBall, BattleInstance, gen_battle  # noqa: E402
+
+
+def make_deck(owner, size, rng):
+    return [
+        BattleBall(f"{owner}-{i}", owner, rng.randint(300, 3000), rng.randint(100, 1500))
+        for i in range(size)
+    ]
+
+
+def run(size, seed=0):
+    rng = random.Random(seed)
+    battle = BattleInstance(make_deck("p1", size, rng), make_deck("p2", size, rng), seed=seed)
+    start = time.perf_counter()
+    for _ in gen_battle(battle):
+        pass
+    elapsed = time.perf_counter() - start
+    return battle.turns, elapsed
+
+
+def main(sizes):
+    for size in sizes:
+        turns, elapsed = run(size)
+        print(
+            f"{size:>6} balls: {turns:>7} turns in {elapsed * 1000:8.1f} ms "
+            f"({turns / elapsed:,.0f} turns/s)"
+        )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10, 100, 1000, 5000])
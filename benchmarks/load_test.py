@@ -0,0 +1,496 @@
+"""
+Load test of the battle cog against an in-process fake of the Discord API.
+
+    python benchmarks/load_test.py                          # 200 guilds, 1 battle each
+    python benchmarks/load_test.py --guilds 500 --latency 0.3 --rate-limits 0.05
+
+Every guild plays /battle start, /battle add and /battle remove, then presses
+Ready (or Cancel) through the cog's own callbacks. Interactions and messages
+are stand-ins that wait `--latency` seconds per API call and answer some edits
+with a 429. The report gives the event loop lag, edits per second, task counts
+and memory growth.
+
+Run it from a BallsDex checkout (the database is never touched, results are
+kept in memory) or from this repository alone: when `ballsdex` is not
+importable, the battle folder is mounted as `ballsdex.packages.battle` with
+stand-ins for the few BallsDex modules the cog imports. discord.py is required.
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+import types
+from pathlib import Path
+
+import discord
+from discord import app_commands
+
+BATTLE_DIR = Path(__file__).resolve().parent.parent / "battle"
+
+
+def _mount_ballsdex():
+    try:
+        import ballsdex.core.models  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    def module(name, **attributes):
+        module = sys.modules.setdefault(name, types.ModuleType(name))
+        module.__dict__.update(attributes)
+        return module
+
+    class Ball:
+        def __init__(self, pk, country, health, attack):
+            self.pk = pk
+            self.country = country
+            self.health = health
+            self.attack = attack
+            self.emoji_id = pk
+            self.enabled = True
+
+    class BallInstance:
+        def __init__(self, id, ball, health, attack):
+            self.id = id
+            self.ball_id = ball.pk
+            self.health = health
+            self.attack = attack
+            self.attack_bonus = 0
+            self.health_bonus = 0
+
+    class Player:
+        pass
+
+    class Transformer(app_commands.Transformer):
+        async def transform(self, interaction, value):
+            return value
+
+    for name in ("ballsdex", "ballsdex.core", "ballsdex.core.utils", "ballsdex.packages"):
+        module(name).__path__ = []
+    module("ballsdex.core.models", Ball=Ball, BallInstance=BallInstance, Player=Player, balls={})
+    module("ballsdex.core.bot", BallsDexBot=object)
+    module(
+        "ballsdex.settings",
+        settings=types.SimpleNamespace(root_role_ids=[], admin_role_ids=[]),
+    )
+    module(
+        "ballsdex.core.utils.transformers",
+        BallInstanceTransform=app_commands.Transform[BallInstance, Transformer],
+        BallTransform=app_commands.Transform[Ball, Transformer],
+    )
+    package = module("ballsdex.packages.battle")
+    package.__path__ = [str(BATTLE_DIR)]
+    # only imported by the result writer, which is replaced below
+    module("tortoise", Tortoise=None)
+    module("tortoise.transactions", in_transaction=None)
+
+
+_mount_ballsdex()
+
+from ballsdex.core.models import Ball, BallInstance  # noqa: E402
+from ballsdex.core.models import balls as countryballs  # noqa: E402
+from ballsdex.packages.battle import cog as battle_cog  # noqa: E402
+from ballsdex.packages.battle.persistence import Rating  # noqa: E402
+
+
+class FakeGateway:
+    """Counts the API calls of the fake Discord objects and injects latency and 429s."""
+
+    def __init__(self, latency, jitter, rate_limits, retry_after, raise_rate_limits, seed):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limits = rate_limits
+        self.retry_after = retry_after
+        self.raise_rate_limits = raise_rate_limits
+        self.rng = random.Random(seed)
+        self.calls = {}
+        self.injected_429 = 0
+        self.ids = itertools.count(10**17)
+
+    async def request(self, kind):
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+        delay = self.latency * self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+        if kind == "edit" and self.rng.random() < self.rate_limits:
+            self.injected_429 += 1
+            if self.raise_rate_limits:
+                await asyncio.sleep(delay)
+                raise discord.RateLimited(self.retry_after)
+            # discord.py waits out 429s inside the request by default
+            delay += self.retry_after
+        await asyncio.sleep(delay)
+
+
+class FakeUser:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{id}>"
+
+
+class FakeMessage:
+    def __init__(self, gateway, channel):
+        self.gateway = gateway
+        self.id = next(gateway.ids)
+        self.channel = channel
+        self.jump_url = f"https://discord.com/channels/0/{channel.id}/{self.id}"
+        self.embed = None
+
+    async def edit(self, *, embed=None, **kwargs):
+        await self.gateway.request("edit")
+        if embed is not None:
+            self.embed = embed.to_dict()
+        return self
+
+    async def delete(self):
+        await self.gateway.request("delete")
+
+
+class FakeChannel:
+    def __init__(self, gateway, id):
+        self.gateway = gateway
+        self.id = id
+
+    async def send(self, content=None, **kwargs):
+        await self.gateway.request("send")
+        return FakeMessage(self.gateway, self)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    def _respond(self):
+        if self.done:
+            raise discord.InteractionResponded(self.interaction)
+        self.done = True
+
+    async def send_message(self, content=None, **kwargs):
+        self._respond()
+        await self.interaction.gateway.request("send")
+        interaction = self.interaction
+        interaction.original = FakeMessage(interaction.gateway, interaction.channel)
+
+    async def defer(self, **kwargs):
+        self._respond()
+        await self.interaction.gateway.request("defer")
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        await self.interaction.gateway.request("send")
+        return FakeMessage(self.interaction.gateway, self.interaction.channel)
+
+
+class FakeInteraction:
+    """The parts of discord.Interaction the battle cog uses."""
+
+    def __init__(self, gateway, user, guild_id, channel, message=None):
+        self.gateway = gateway
+        self.id = next(gateway.ids)
+        self.created_at = discord.utils.utcnow()
+        self.user = user
+        self.guild_id = guild_id
+        self.channel = channel
+        self.channel_id = channel.id
+        self.message = message  # the message of the clicked button
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.original = None
+
+    async def original_response(self):
+        await self.gateway.request("fetch")
+        return self.original
+
+    async def edit_original_response(self, **kwargs):
+        await self.gateway.request("edit")
+        return self.original
+
+    async def delete_original_response(self):
+        await self.gateway.request("delete")
+
+
+class FakeBot:
+    def get_emoji(self, emoji_id):
+        return None
+
+
+class MemoryResults:
+    """Stands in for the result writer, keeps the records in memory."""
+
+    def __init__(self):
+        self.records = []
+        self.ratings = {}
+        self.backlog = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def record(self, record):
+        self.records.append(record)
+
+    async def get_rating(self, discord_id):
+        return self.ratings.setdefault(discord_id, Rating(discord_id))
+
+    def leaderboard(self, size=10):
+        return []
+
+
+class LoopMonitor:
+    """Samples the event loop lag and the task count while the load test runs."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lags = []
+        self.tasks = []
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(time.perf_counter() - started - self.interval)
+            self.tasks.append(len(asyncio.all_tasks()))
+
+
+def make_collection(rng, owner_id, size):
+    ball_ids = list(countryballs)
+    return [
+        BallInstance(
+            owner_id * 1000 + i,
+            countryballs[rng.choice(ball_ids)],
+            rng.randint(300, 3000),
+            rng.randint(100, 1500),
+        )
+        for i in range(size)
+    ]
+
+
+async def play_guild(cog, gateway, guild_id, args, rng):
+    channel = FakeChannel(gateway, guild_id * 10)
+    author = FakeUser(guild_id * 2, f"author-{guild_id}")
+    opponent = FakeUser(guild_id * 2 + 1, f"opponent-{guild_id}")
+    decks = {
+        user.id: make_collection(rng, user.id, args.deck_size + 1) for user in (author, opponent)
+    }
+
+    def interaction(user, message=None):
+        return FakeInteraction(gateway, user, guild_id, channel, message)
+
+    async def think():
+        await asyncio.sleep(rng.uniform(0, args.think))
+
+    await asyncio.sleep(rng.uniform(0, args.ramp_up))
+    for _ in range(args.battles):
+        setup = interaction(author)
+        instant = rng.random() < args.instant
+        await cog.start.callback(cog, setup, opponent, args.deck_size, instant)
+        battle_id = setup.id
+
+        for user in (author, opponent):
+            for instance in decks[user.id][: args.deck_size]:
+                await think()
+                await cog.add.callback(cog, interaction(user), instance)
+            if rng.random() < args.churn:
+                # swap the last ball for the spare one
+                await think()
+                deck = decks[user.id]
+                await cog.remove.callback(cog, interaction(user), deck[args.deck_size - 1])
+                await cog.add.callback(cog, interaction(user), deck[args.deck_size])
+
+        await think()
+        if rng.random() < args.cancel:
+            await cog.cancel_battle(battle_id, interaction(author, setup.original))
+            continue
+        await cog.start_battle(battle_id, interaction(author, setup.original))
+        await think()
+        watching = asyncio.create_task(spectate(cog, gateway, guild_id, author, args, rng))
+        try:
+            await cog.start_battle(battle_id, interaction(opponent, setup.original))
+        finally:
+            watching.cancel()
+
+
+async def spectate(cog, gateway, guild_id, player, args, rng):
+    """Mirrors the live battle of `player` in `--spectators` other channels of the guild."""
+    for i in range(1, args.spectators + 1):
+        guild_battle = cog.get_battle(player)
+        while guild_battle is not None and guild_battle.broadcast is None:
+            await asyncio.sleep(0.05)
+        if guild_battle is None:
+            return
+        await asyncio.sleep(rng.uniform(0, args.think))
+        viewer = FakeUser(guild_id * 100 + i, f"spectator-{guild_id}-{i}")
+        channel = FakeChannel(gateway, guild_id * 10 + i)
+        await cog.spectate.callback(
+            cog, FakeInteraction(gateway, viewer, guild_id, channel), player
+        )
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    battle_cog.TURN_INTERVAL = args.turn_interval
+    battle_cog.SIMULATION_WORKERS = args.workers
+    countryballs.clear()
+    for pk in range(1, 51):
+        countryballs[pk] = Ball(
+            pk, f"Country {pk}", rng.randint(300, 3000), rng.randint(100, 1500)
+        )
+
+    gateway = FakeGateway(
+        args.latency,
+        args.jitter,
+        args.rate_limits,
+        args.retry_after,
+        args.raise_rate_limits,
+        args.seed,
+    )
+    cog = battle_cog.Battle(FakeBot())
+    cog.results = MemoryResults()
+    cog.render_scheduler.edits_per_second = args.edits_per_second
+    cog.render_scheduler._tokens = args.edits_per_second
+    await cog.cog_load()
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    gc.collect()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    traced_before = tracemalloc.get_traced_memory()[0] if args.tracemalloc else 0
+    monitor = LoopMonitor(args.sample_interval)
+    monitor.start()
+
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(play_guild(cog, gateway, guild_id, args, random.Random(rng.random()))
+          for guild_id in range(1, args.guilds + 1)),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - started
+
+    await monitor.stop()
+    gauges = cog.gauges()
+    await cog.cog_unload()
+    gc.collect()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if args.tracemalloc:
+        traced_after, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    errors = [result for result in results if isinstance(result, BaseException)]
+    counters = cog.metrics.counters
+    edit_seconds = cog.metrics.histograms["message_edit_seconds"]
+    lags = monitor.lags
+
+    print(f"{args.guilds} guilds, {args.battles} battle(s) each, in {elapsed:.1f}s")
+    print(
+        f"battles: {counters['battles_started']} started, {counters['battles_finished']} "
+        f"finished, {counters['battles_cancelled']} cancelled, {len(errors)} guilds failed"
+    )
+    print(
+        f"event loop lag: mean {statistics.fmean(lags) * 1000 if lags else 0:.1f}ms, "
+        f"p99 {percentile(lags, 0.99) * 1000:.1f}ms, max {max(lags, default=0) * 1000:.1f}ms"
+    )
+    edits = gateway.calls.get("edit", 0)
+    print(
+        f"API calls: {sum(gateway.calls.values())} "
+        + ", ".join(f"{kind} {count}" for kind, count in sorted(gateway.calls.items()))
+    )
+    print(
+        f"edits: {edits / elapsed:.1f}/s, {counters['message_edits']} live edits "
+        f"(mean {edit_seconds.mean * 1000:.0f}ms), {gateway.injected_429} 429s injected, "
+        f"{counters['rate_limits']} seen by the render scheduler, "
+        f"{counters['frames_rendered']} frames rendered"
+    )
+    print(
+        f"tasks: max {max(monitor.tasks, default=0)}, "
+        f"mean {statistics.fmean(monitor.tasks) if monitor.tasks else 0:.0f}, "
+        f"left after the run: {len(asyncio.all_tasks()) - 1}"
+    )
+    print(f"memory: max RSS +{(rss_after - rss_before) / 1024:.1f} MiB", end="")
+    if args.tracemalloc:
+        print(
+            f", traced +{(traced_after - traced_before) / 2**20:.2f} MiB "
+            f"(peak {traced_peak / 2**20:.1f} MiB)",
+            end="",
+        )
+    print(
+        f", battles held at the end: {gauges['active_battles']} "
+        f"({gauges['battles_memory_bytes'] / 1024:.1f} KiB)"
+    )
+    failures = {}
+    for error in errors:
+        failures[repr(error)] = failures.get(repr(error), 0) + 1
+    for error, count in failures.items():
+        print(f"{count} guilds failed with {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--battles", type=int, default=1, help="battles per guild, one at a time")
+    parser.add_argument("--deck-size", type=int, default=4)
+    parser.add_argument("--instant", type=float, default=0.2, help="share of instant battles")
+    parser.add_argument("--cancel", type=float, default=0.1, help="share of cancelled plans")
+    parser.add_argument(
+        "--churn", type=float, default=0.3, help="share of players swapping a ball"
+    )
+    parser.add_argument("--think", type=float, default=0.5, help="max seconds between two clicks")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="seconds to start every guild")
+    parser.add_argument(
+        "--spectators", type=int, default=0, help="channels mirroring each live battle"
+    )
+    parser.add_argument("--turn-interval", type=float, default=0.1)
+    parser.add_argument("--latency", type=float, default=0.15, help="seconds per API call")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency varies by this share")
+    parser.add_argument(
+        "--rate-limits", type=float, default=0.02, help="share of edits hit by 429"
+    )
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument(
+        "--raise-rate-limits",
+        action="store_true",
+        help="raise RateLimited instead of waiting like discord.py does by default",
+    )
+    parser.add_argument("--edits-per-second", type=float, default=40.0)
+    parser.add_argument("--workers", type=int, default=0, help="simulation processes")
+    parser.add_argument("--sample-interval", type=float, default=0.05)
+    parser.add_argument("--tracemalloc", action="store_true", help="trace allocations (slower)")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()